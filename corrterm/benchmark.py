@@ -0,0 +1,291 @@
+# FILE: benchmark.py
+
+'''
+Benchmarks for the correction term pipeline.
+
+usage: python benchmark.py [-s] [-b baseline.json] [workload ...]
+
+Times each stage (loading, regions, each step of the graph of regions,
+quadratic form, Smith normal form, NDQF, and each correction term engine) on
+a fixed corpus of workloads:
+    startup:<module> the import of <module> (corrterms, the command line) in
+                     a fresh interpreter: stage 'import'
+    knotilus:<name>  Knotilus files in ../testing
+    plink:<name>     Plink files in ../testing and test/testing (the Plink
+                     loader opens the editor, so these are skipped without
+                     a display)
+    seifert-a:<p>    [-1, (2, 1), (3, 1), (p, 1)] for growing p
+    seifert-b:<p>    [3, (2, -1), (3, -2), (p, 1 - p)] (branch of length p - 1)
+    forest:<n>       random negative definite forest with n vertices (seeded)
+With no workloads listed, runs all of them.
+
+For links the stages edges_regions, maximal_subtree and minus (the graph of
+regions), quad_form (the quadratic form from that graph) and goeritz_form
+(straight from the regions, as corrterms.main and the GUI do) are timed
+separately; the engines use the form from goeritz_form.
+
+Each workload runs in its own interpreter, so that its peak resident set size
+(RSS, including the worker processes) is its own. Reports the wall time of
+each stage, the peak RSS, and alphas/second for the engines that iterate
+through the whole box of characteristic vectors ('box' and 'threaded';
+skipped, with 'bounded', when the box has more than MAX_BOX of them). All
+engines of a workload must give the same correction terms.
+
+The times are compared with the baseline file (default BASELINE), and
+slower stages are flagged as regressions (exit status 1).
+-s to save the results as the new baseline instead.
+The committed benchmark_baseline.json was saved without a display (so with
+the Plink workloads skipped); times depend on the machine, so save a
+baseline with -s on the machine to compare on before changing the code.
+'''
+
+import hashlib, json, os, random, resource, subprocess, sys, time
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+TESTING = [os.path.join(DIRECTORY, '..', 'testing'),
+           os.path.join(DIRECTORY, 'test', 'testing')]
+BASELINE = os.path.join(DIRECTORY, 'benchmark_baseline.json')
+MAX_BOX = 2 * 10**5 # most characteristic vectors searched by 'box', 'bounded',
+                    # 'threaded'
+TOLERANCE = 1.5     # flag a stage taking more than TOLERANCE * baseline,
+MIN_CHANGE = 0.05   # and more than MIN_CHANGE seconds longer than baseline
+SEIFERT_A = [7, 13, 31, 61, 127]
+SEIFERT_B = [5, 7, 9, 11, 13]
+FORESTS = [4, 6, 8, 10]
+STARTUP = ['corrterms']
+
+def corpus():
+    '''Returns the names of all workloads, in order.'''
+    names = ['startup:%s' % module for module in STARTUP]
+    for directory in TESTING:
+        for filename in sorted(os.listdir(directory)):
+            if not filename.endswith('.txt'):
+                continue
+            with open(os.path.join(directory, filename)) as input_file:
+                first = input_file.readline()
+            if first.startswith('This file contains the verticies'):
+                names.append('knotilus:%s' % filename[:-4])
+            elif first.startswith('% Link Projection'):
+                names.append('plink:%s' % filename[:-4])
+    names.extend('seifert-a:%i' % p for p in SEIFERT_A)
+    names.extend('seifert-b:%i' % p for p in SEIFERT_B)
+    names.extend('forest:%i' % n for n in FORESTS)
+    return names
+
+def find_file(name):
+    for directory in TESTING:
+        path = os.path.join(directory, name + '.txt')
+        if os.path.exists(path):
+            return path
+    raise IOError('No file %s.txt' % name)
+
+def random_forest(size, seed=0):
+    '''
+    Returns the quadratic form (numpy array) of a random weighted forest with
+    'size' vertices. Every weight is at most -(degree + 1), so the form is
+    strictly diagonally dominant, hence negative definite.
+    '''
+    import numpy
+    generator = random.Random(seed)
+    quad = numpy.zeros((size, size), dtype=int)
+    for vertex in xrange(1, size):
+        if generator.random() < 0.8: # else vertex starts a new tree
+            parent = generator.randrange(vertex)
+            quad[vertex, parent] = quad[parent, vertex] = 1
+    for vertex in xrange(size):
+        degree = quad[vertex].sum()
+        quad[vertex, vertex] = -(degree + 1 + generator.randint(0, 1))
+    return quad
+
+class Timer(object):
+    '''Times the stages of one workload, with their output hidden.'''
+    def __init__(self):
+        self.times = {}
+
+    def __call__(self, stage, function, *args):
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            start = time.time()
+            result = function(*args)
+            self.times[stage] = time.time() - start
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        return result
+
+def run_workload(name):
+    '''
+    Runs the workload 'name' in this process, and returns the results as a
+    dict: 'times' (stage -> seconds), 'rss' (peak RSS in kB), 'alphas'
+    (number of characteristic vectors in the box), 'corrterms' (SHA-1 of
+    the pretty-printed terms, to keep the baseline small), or 'skipped'
+    (reason).
+    '''
+    kind, argument = name.split(':', 1)
+    timer = Timer()
+    if kind == 'startup': # before anything else is imported
+        timer('import', __import__, argument)
+        return {'times': timer.times, 
+                'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+    from graph_quad import NodeClass, edges_regions, maximal_subtree, \
+         minus_maximal_subtree, quad_form, goeritz_form
+    from smith import smith_normal_form
+    from ndqf import NDQF
+    import numpy, seifert
+    listdata = None
+    if kind in ('knotilus', 'plink'):
+        path = find_file(argument)
+        if kind == 'knotilus':
+            import knotilus_load
+            data = timer('load', knotilus_load.load_knotilus, path)
+            regions = timer('regions', knotilus_load.make_objects,
+                            *data[:3])[3]
+        else:
+            import plink_load
+            try:
+                data = timer('load', plink_load.load_plink, path)
+            except Exception as error: # TclError without a display
+                return {'skipped': '%s: %s' % (type(error).__name__, error)}
+            regions = timer('regions', plink_load.make_objects, *data[:6])[3]
+        nodes = [NodeClass(i) for i in range(len(regions))]
+        tree = timer('edges_regions', edges_regions, nodes, regions)
+        subtree = timer('maximal_subtree', maximal_subtree, tree, nodes)
+        minus = timer('minus', minus_maximal_subtree, tree, subtree)
+        timer('quad_form', quad_form, tree, minus, nodes)
+        quad = timer('goeritz_form', goeritz_form, regions)
+    elif kind in ('seifert-a', 'seifert-b'):
+        p = int(argument)
+        if kind == 'seifert-a':
+            listdata = [-1, (2, 1), (3, 1), (p, 1)]
+        else:
+            listdata = [3, (2, -1), (3, -2), (p, 1 - p)]
+        quad = timer('quad_form', seifert.s_quad_form, listdata, False)[0]
+    elif kind == 'forest':
+        quad = random_forest(int(argument))
+    else:
+        raise ValueError('Unknown workload %s' % name)
+    timer('smith_normal_form', smith_normal_form, numpy.matrix(quad))
+    form = timer('NDQF', NDQF, quad)
+    alphas = len(form.get_alpha(characteristic=True))
+    # 'reduced' is the default pipeline: engine 'auto' on the LLL reduced form
+    engines = [('pruned', form.correction_terms_pruned, ()),
+               ('reduced', form.correction_term_list, ())]
+    if alphas <= MAX_BOX:
+        engines = [('box', form.correction_terms_ugly, ()),
+                   ('bounded', form.correction_terms_bounded, ()),
+                   ('threaded', form.correction_terms_threaded, ())] + engines
+    if listdata is not None:
+        engines.append(('seifert', seifert.s_corr_terms, (listdata, form)))
+    results = {}
+    for engine, function, args in engines:
+        results[engine] = timer(engine, function, *args)
+    if len(set(tuple(terms) for terms in results.values())) != 1:
+        raise AssertionError('Engines disagree on %s' % name)
+    rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+              resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return {'times': timer.times, 'rss': rss, 'alphas': alphas,
+            'b': form.b, 'group': form.group.struct(),
+            'corrterms': hashlib.sha1(
+                form.pretty_print(results.values()[0])).hexdigest()}
+
+def measure(name):
+    '''Runs the workload 'name' in a new interpreter, returns its results
+    (with 'failed' instead if it raised an exception).'''
+    command = [sys.executable, os.path.abspath(__file__), '-w', name]
+    process = subprocess.Popen(command, cwd=DIRECTORY, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    output, errors = process.communicate()
+    if process.returncode:
+        return {'failed': errors.strip().splitlines()[-1]}
+    return json.loads(output.splitlines()[-1])
+
+def regressions(results, baseline):
+    '''Returns a list of strings describing the stages of 'results' slower
+    than in 'baseline' (both dicts workload -> result).'''
+    slower = ['%s failed: %s' % (name, result['failed'])
+              for name, result in sorted(results.items()) if 'failed' in result]
+    for name, result in sorted(results.items()):
+        if 'times' not in result or name not in baseline or 'times' not in baseline[name]:
+            continue
+        old = baseline[name]
+        if result.get('corrterms') != old.get('corrterms'):
+            slower.append('%s: correction terms changed' % name)
+        for stage, seconds in sorted(result.get('times', {}).items()):
+            before = old['times'].get(stage)
+            if before is not None and seconds > TOLERANCE * before and \
+               seconds - before > MIN_CHANGE:
+                slower.append('%s %s: %.3fs, baseline %.3fs'
+                              % (name, stage, seconds, before))
+        if result['rss'] > TOLERANCE * old['rss']:
+            slower.append('%s peak RSS: %i kB, baseline %i kB'
+                          % (name, result['rss'], old['rss']))
+    return slower
+
+def report(name, result):
+    if 'skipped' in result or 'failed' in result:
+        print '%-20s %s' % (name, ' '.join('%s (%s)' % item for item in
+                                            result.items()))
+        return
+    if 'b' in result:
+        print '%-20s b=%i H_1=%s box=%i peak RSS=%i kB' \
+              % (name, result['b'], result['group'], result['alphas'],
+                 result['rss'])
+    else:
+        print '%-20s peak RSS=%i kB' % (name, result['rss'])
+    for stage, seconds in sorted(result['times'].items(),
+                                 key=lambda item: item[1], reverse=True):
+        line = '    %-18s %9.4f s' % (stage, seconds)
+        if stage in ('box', 'threaded') and seconds > 0:
+            line += '  %12.0f alphas/s' % (result['alphas'] / seconds)
+        print line
+
+def usage():
+    print 'usage: python %s [-s] [-b baseline.json] [workload ...]' \
+          % sys.argv[0]
+    print 'workloads: %s' % ' '.join(corpus())
+    sys.exit(1)
+
+def main(args):
+    save = False
+    baseline_path = BASELINE
+    names = []
+    while args:
+        arg = args.pop(0)
+        if arg == '-s':
+            save = True
+        elif arg == '-b' and args:
+            baseline_path = args.pop(0)
+        elif arg[0] == '-':
+            usage()
+        else:
+            names.append(arg)
+    names = names or corpus()
+    results = {}
+    for name in names:
+        results[name] = measure(name)
+        report(name, results[name])
+    if save:
+        if any('failed' in result for result in results.values()):
+            print 'Not saving a baseline with failed workloads'
+            return 1
+        with open(baseline_path, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=1, sort_keys=True)
+        print 'Saved baseline to %s' % baseline_path
+        return 0
+    if not os.path.exists(baseline_path):
+        print 'No baseline %s (run with -s to save one)' % baseline_path
+        return 0
+    with open(baseline_path) as baseline_file:
+        slower = regressions(results, json.load(baseline_file))
+    for line in slower:
+        print 'REGRESSION %s' % line
+    if not slower:
+        print 'No regressions against %s' % baseline_path
+    return 1 if slower else 0
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] == '-w': # one workload, as JSON
+        print json.dumps(run_workload(sys.argv[2]))
+    else:
+        sys.exit(main(sys.argv[1:]))
@@ -1,26 +1,46 @@
 # FILE: corrterms.py
 
 from graph_quad import *
-from seifert import s_quad_form, parse_seifert, correct_form
-from ndqf import NDQF
-import traceback
+from seifert import s_quad_form, parse_seifert, correct_form, s_corr_terms
+from ndqf import NDQF, homology_struct
+from smith import invariant_factors
+from term_cache import default_cache
+from multiprocessing import Pool
+import json, os, sys, traceback
 
 '''
 Command line usage for double branched cover and Seifert data
 OR     python corrterms.py [-k] [-m] archive_num
 OR     python corrterms.py -kf [-m] archive_num.txt
 OR     python corrterms.py -p [-m] [filename]
-OR     python corrterms.py -s [-m] '[e, (p1, q1),...,(pr, qr)]'
+OR     python corrterms.py -s [-m] [-c] '[e, (p1, q1),...,(pr, qr)]'
+OR     python corrterms.py -g [-m] [-c] graph.txt
+OR     python corrterms.py -b manifest.txt
+OR     python corrterms.py -H -<option> <data>
 
 [-k] to download and save Knotilus archive_num plaintext to archive_num.txt
 -kf to load archive_num.txt (Knotilus plaintext file)
 -p to use Plink, [filename] to load file
 -s to use Seifert data
-[-m] to use multiprocessing
+-g to load a weighted graph file (saved by weighted_graph.py)
+-b to run every input listed in manifest.txt (see batch)
+[-m] to use multiprocessing (with -s and -g, in the search of -c)
+[-c] to check the Seifert or graph correction terms against the quadratic
+     form search
+-H to only print H_1(Y) (homology_only), for any of the inputs above
+
+Set HFHOM_CACHE to a file path (or 'on' for ~/.hfhom/corrterms.sqlite) to
+cache correction terms on disk; see term_cache.py. It is off by default.
+
+Only the quadratic form and correction term modules are imported at startup;
+Plink, Knotilus, Tkinter and networkx are imported when an input needs them.
 '''
 
-def seifert_corr(stringdata, use_multi=False):
-    '''Parse Seifert data, output correction terms.'''
+def seifert_corr(stringdata, use_multi=False, check=False):
+    '''Parse Seifert data, output correction terms. They are computed from
+    the Seifert data (seifert.s_corr_terms); with 'check', also by the 
+    search of the quadratic form (with multiprocessing if 'use_multi'), 
+    which must agree.'''
     try:
         if stringdata == '':
             raise ValueError('empty string')
@@ -37,24 +57,55 @@ def seifert_corr(stringdata, use_multi=False):
         print quad
         quadform = NDQF(quad[0])
         print 'H_1(Y) ~ %s' % quadform.group.struct()        
-        if use_multi:
-            corr = quadform.correction_terms_threaded()
-        else:
-            corr = quadform.correction_terms_ugly()
+        corr = s_corr_terms(data, quadform, cache=default_cache(), 
+                            check=check, multiprocessing=use_multi)
         if quad[1]: # reversed orientation
             corr = map(lambda n: -n, corr)
         corr = quadform.pretty_print(corr) # make Fractions pretty
     return corr
 
-def main(loading_type, loading_data=None, use_multi=False):
+def load_graph(filename):
+    '''Returns (graph, node_list) of the weighted graph file 'filename' 
+    (saved by weighted_graph.py).'''
+    from weighted_graph import GraphPopup
+    popup = GraphPopup(None, gui=False)
+    popup.load(filename)
+    if not popup.nodes: # load prints the error instead of raising it
+        raise ValueError('Could not load graph from %s' % filename)
+    return popup.graph, popup.nodes
+
+def graph_corr(filename, check=False, use_multi=False):
+    '''Load a weighted graph file, output correction terms. They are 
+    computed from the trees of the graph (plumbing.p_corr_terms); with 
+    'check', also by the search of the quadratic form (with multiprocessing
+    if 'use_multi'), which must agree.'''
+    from weighted_graph import g_quad
+    from plumbing import p_corr_terms
+    graph, nodes = load_graph(filename)
+    quad = g_quad(graph, nodes, gui=False)
+    print quad
+    quadform = NDQF(quad)
+    print 'H_1(Y) ~ %s' % quadform.group.struct()
+    corr = p_corr_terms(graph, nodes, quadform, cache=default_cache(),
+                        check=check, multiprocessing=use_multi)
+    return quadform.pretty_print(corr) # make Fractions pretty
+
+def main(loading_type, loading_data=None, use_multi=False, check=False):
     '''
     Return Heegaard Floer correction terms.
     
-    loading_type - 'k' for Knotilus, 'p' for PLink, 's' for Seifert
+    loading_type - 'k' for Knotilus, 'p' for PLink, 's' for Seifert,
+                   'g' for weighted graph file
     loading_data - Knotilus archive number, filename, Seifert data
-    multi - use multiprocessing or not
+    multi - use multiprocessing or not (Seifert data and weighted graphs: 
+            for the check)
+    check - check Seifert or graph correction terms against the quadratic 
+            form search
     '''
     print '\n%s' %loading_data
+    if loading_type in ('p', '', 'k', 'kf'):
+        from plink_load import load_plink, make_objects
+        from knotilus_load import load
     if loading_type == 'p': # PLink
         if loading_data:
             print 'Loading PLink'
@@ -75,37 +126,176 @@ def main(loading_type, loading_data=None, use_multi=False):
         regions = load(loading_data, True, False)[3]
     elif loading_type == 's':
         print 'Seifert data'
+    elif loading_type == 'g':
+        print 'Loading weighted graph file'
     else:
         usage()
     # compute correction terms
-    if loading_type != 's':
+    if loading_type == 'g':
+        print graph_corr(loading_data, check, use_multi)
+    elif loading_type != 's':
         if regions: # non-empty (i.e. not unknot with no crossings)         
-            nodes = [NodeClass(i) for i in range(len(regions))]
-            tree = edges_regions(nodes,regions)
-            max_subtree = maximal_subtree(tree, nodes)
-            minus = minus_maximal_subtree(tree, max_subtree)
-            quad = quad_form(tree, minus, nodes)
+            quad = goeritz_form(regions)
             print quad
             quadform = NDQF(quad)
-            corr = quadform.correction_terms(use_multi)
+            corr = quadform.correction_terms(use_multi, cache=default_cache())
         else: # unknot with no crossings
             print 'quadratic form N/A (unknot with no crossings)'
             print 'H_1(Y) ~ 1'
             print '0' # corrterms - only 1 spin structure
     else: # Seifert
-        corr = seifert_corr(loading_data, use_multi)
+        corr = seifert_corr(loading_data, use_multi, check)
         print corr
     return
         
+def quad_from_input(loading_type, loading_data):
+    '''
+    Returns (quad, minus) for one input without any GUI: the quadratic form
+    (numpy array), or None for the unknot with no crossings, and True if the
+    orientation was reversed (Seifert data), False otherwise.
+    
+    loading_type - 'k' for Knotilus archive, 'kf' for Knotilus file, 
+                   'p' for PLink file, 's' for Seifert data, 
+                   'g' for weighted graph file (saved by weighted_graph.py)
+    '''
+    if loading_type == 's':
+        data = parse_seifert(loading_data)
+        if not correct_form(data, gui=False):
+            raise ValueError('Invalid Seifert data %s' % loading_data)
+        return s_quad_form(data, gui=False)
+    if loading_type == 'g':
+        from weighted_graph import g_quad
+        graph, nodes = load_graph(loading_data)
+        return g_quad(graph, nodes, gui=False), False
+    from plink_load import load_plink, make_objects
+    from knotilus_load import load
+    if loading_type == 'p':
+        data = load_plink(loading_data)
+        regions = make_objects(data[0], data[1], data[2], data[3], data[4], 
+                               data[5])[3]
+    elif loading_type == 'k':
+        regions = load(loading_data, False, False)[3]
+    elif loading_type == 'kf':
+        regions = load(loading_data, True, False)[3]
+    else:
+        raise ValueError('Unknown input type %r' % loading_type)
+    if not regions: # unknot with no crossings
+        return None, False
+    return goeritz_form(regions), False
+
+def homology_only(loading_type, loading_data):
+    '''
+    Returns H_1(Y) (string, as Hom_Group.struct) for one input (see 
+    quad_from_input) from the invariant factors of its quadratic form only
+    (smith.invariant_factors): no NDQF, no correction terms.
+    '''
+    quad, minus = quad_from_input(loading_type, loading_data)
+    if quad is None: # unknot with no crossings
+        return '1'
+    return homology_struct(invariant_factors(quad))
+
+def parse_manifest_line(line):
+    '''
+    Returns (loading_type, loading_data) for a line of a batch manifest, or
+    None for blank lines and comments (#).
+    
+    Each line is an option of this script followed by its data, e.g.
+        -s [-1, (2, 1), (3, 1), (5, 1)]
+        -kf testing/10x-2-1.txt
+        -p link.lnk
+        -g testing/forest_ex1.txt (weighted graph file)
+        -k 10x-2-1 (Knotilus archive number)
+    Lines starting with '[' are Seifert data.
+    '''
+    line = line.strip()
+    if not line or line[0] == '#':
+        return None
+    if line[0] == '[':
+        return 's', line
+    if line[0] != '-' or len(line.split(None, 1)) != 2:
+        raise ValueError('Cannot parse manifest line %r' % line)
+    option, data = line.split(None, 1)
+    return option[1:], data.strip()
+
+def init_batch_worker():
+    '''Pool initializer: silences the progress printing of the workers, 
+    so that only the JSON lines go to stdout.'''
+    sys.stdout = open(os.devnull, 'w')
+
+def batch_item(item):
+    '''
+    Returns the result for one manifest line 'item' (line_number, line) as
+    a dict, with the error message instead if it failed.
+    For multiprocessing, can't pickle unless fcn is at top level of module.
+    '''
+    line_number, line = item
+    result = {'line': line_number, 'input': line.strip()}
+    try:
+        loading_type, loading_data = parse_manifest_line(line)
+        if loading_type == 'g': # the graph is needed again for the terms
+            from weighted_graph import g_quad
+            graph, nodes = load_graph(loading_data)
+            quad, minus = g_quad(graph, nodes, gui=False), False
+        else:
+            quad, minus = quad_from_input(loading_type, loading_data)
+        if quad is None: # unknot with no crossings
+            result.update(homology='1', quad=None, corrterms='0')
+            return result
+        quadform = NDQF(quad)
+        if loading_type == 's':
+            corr = s_corr_terms(parse_seifert(loading_data), quadform, 
+                                cache=default_cache())
+        elif loading_type == 'g':
+            from plumbing import p_corr_terms
+            corr = p_corr_terms(graph, nodes, quadform, 
+                                cache=default_cache())
+        else:
+            corr = quadform.correction_term_list(cache=default_cache())
+        if minus: # reversed orientation
+            corr = map(lambda n: -n, corr)
+        result.update(homology=quadform.group.struct(), quad=quad.tolist(),
+                      corrterms=quadform.pretty_print(corr),
+                      self_conjugate=quadform.self_conjugate())
+    except Exception as error:
+        result['error'] = '%s: %s' % (type(error).__name__, error)
+    return result
+
+def batch(manifest, out=sys.stdout, processes=None):
+    '''
+    Computes the correction terms of every input listed in the file
+    'manifest' (see parse_manifest_line) with one pool of 'processes' worker
+    processes (None => cpu_count()), and writes one JSON object per line
+    to 'out' as each input finishes, so not in the order of the manifest.
+    
+    Each object has keys 'line' (line number in manifest), 'input', and 
+    either 'homology', 'quad', 'corrterms', 'self_conjugate' (positions of 
+    the self-conjugate classes in corrterms), or 'error'.
+    '''
+    with open(manifest) as manifest_file:
+        items = [(number, line) for number, line in 
+                 enumerate(manifest_file, 1) if parse_manifest_line(line)]
+    pool = Pool(processes, init_batch_worker)
+    try:
+        for result in pool.imap_unordered(batch_item, items):
+            out.write(json.dumps(result) + '\n')
+            out.flush()
+    finally:
+        pool.close()
+        pool.join()
+
 def usage():
     print 'OR     python corrterms.py [-k] [-m] archive_num'
     print 'OR     python corrterms.py -kf [-m] archive_num.txt'
     print 'OR     python corrterms.py -p [-m] [filename]'
-    print "OR     python corrterms.py -s [-m] '[e, (p1, q1),...,(pr, qr)]'"
+    print "OR     python corrterms.py -s [-m] [-c] '[e, (p1, q1),...,(pr, qr)]'"
+    print 'OR     python corrterms.py -g [-m] [-c] graph.txt'
+    print 'OR     python corrterms.py -b manifest.txt'
+    print 'OR     python corrterms.py -H -<option> <data>'
     sys.exit(1)  
     
 if __name__ == '__main__':
-    mainvars = ['', None, False] # loading_type, data, multi
+    # loading_type, data, multi, check, homology only
+    mainvars = ['', None, False, False, False]
     if len(sys.argv) == 1:
         usage()
     try:
@@ -114,6 +304,10 @@ if __name__ == '__main__':
             if arg[0] == '-':
                 if arg == '-m': # multiprocessing
                     mainvars[2] = True
+                elif arg == '-c': # check Seifert/graph correction terms
+                    mainvars[3] = True
+                elif arg == '-H': # homology only
+                    mainvars[4] = True
                 else:
                     if not mainvars[0]: # loading type
                         mainvars[0] = arg[1:]
@@ -125,7 +319,13 @@ if __name__ == '__main__':
                     mainvars[1] = arg
                 else: # loading data already specified
                     usage()
-        main(mainvars[0], mainvars[1], mainvars[2])
+        if mainvars[0] == 'b': # batch
+            batch(mainvars[1])
+        elif mainvars[4]: # '' is a Knotilus download, as 'k' without saving
+            print 'H_1(Y) ~ %s' % homology_only(mainvars[0] or 'k', 
+                                                mainvars[1])
+        else:
+            main(mainvars[0], mainvars[1], mainvars[2], mainvars[3])
     except Exception:
         print '\nERROR: ABORTING PROGRAM'
         print traceback.format_exc()
@@ -31,11 +31,12 @@ OR     python graph_quad.py -p [filename]
 #                      tuples (node1_index, node2_index) instead of DirEdgeClass
 #                      instances
 
-import numpy, sys, tkFileDialog
+import numpy, sys
 from numpy import linalg as LA
 from plink_classes import IntersectionClass
-from plink_load import load_plink, make_objects
-from knotilus_load import load
+from sparse_form import SparseForm
+# plink_load and knotilus_load (Plink, Tkinter) are only imported to load
+# links, so that the graph and quadratic form methods need no GUI
 
 
 ###############################
@@ -44,10 +45,9 @@ from knotilus_load import load
 class NodeClass():
     def __init__(self, index):
         self.index = index
-        self.path = [] # list of nodes start_node -> self in max subtree
-                       # uses ints, not NodeClass objects
-                       # Note: len(self.path) = len(self.edge_path) + 1
-        self.edge_path = [] # list of Edges start node -> self in max subtree
+        self.parent = None # NodeClass before self in max subtree (None: root)
+        self.parent_edge = None # Edge between self.parent and self
+        self.depth = 0 # number of edges start_node -> self in max subtree
         self.edges = [] # list of all Edges with self as endpoint
 
     def last_ancestor(self, other):
@@ -55,23 +55,29 @@ class NodeClass():
         Return index of the last common ancestor of Nodes 'self' and 'other'. 
         Ancestor can be one of the given nodes if one node is an ancestor of the
         other.
+        
+        Walks up the parent pointers from the deeper node to the depth of the
+        other, then from both until they meet.
         '''
-        if self == other:
-            return self.index
-        path1 = self.path
-        path2 = other.path
-        ancestor = 0
-        # make path1 the shorter one
-        if len(path1) > len(path2):
-            path1, path2 = path2, path1
-        for index, node in enumerate(path1):
-            # paths start out the same; last commmon ancestor is node right 
-            # before paths differ
-            if path2[index] != node:
-                ancestor = path2[index-1] # the last node before they differed
-                break
-            ancestor = node # never differ=> one (node) is ancestor of the other
-        return ancestor
+        node1, node2 = self, other
+        while node1.depth > node2.depth:
+            node1 = node1.parent
+        while node2.depth > node1.depth:
+            node2 = node2.parent
+        while node1 is not node2:
+            node1, node2 = node1.parent, node2.parent
+        return node1.index
+
+    def edges_to(self, ancestor):
+        '''
+        Return the list of Edges self -> ancestor (index) in max subtree.
+        '''
+        edges = []
+        node = self
+        while node.index != ancestor:
+            edges.append(node.parent_edge)
+            node = node.parent
+        return edges
 
 class DirEdgeClass():
     def __init__(self, edge):
@@ -102,31 +108,108 @@ def edges_regions(Nodes, Regions):
     an edge between 1st and 2nd Regions.
     '''
     edge_list = []
-    region_pairs = [(region1, region2) for region1 in Regions \
-                    for region2 in Regions \
-                    if Regions.index(region1) < Regions.index(region2)]
-    for pair in region_pairs:
-        for inter in range(pair[0].num_inter(pair[1])): 
-            # for the number of intersections between the 2 regions in 'pair'
-            index0 = Regions.index(pair[0])
-            index1 = Regions.index(pair[1])
-            new_edge = DirEdgeClass((index0, index1))
-            edge_list.append(new_edge) # add edge b/w regions
-            Nodes[index0].edges.append(new_edge) # update self.edges
-            Nodes[index1].edges.append(new_edge) # ^(inter = edge index)
-    # now check for self-loops, i.e. intersections that are visited twice.
-    for region in Regions:
-        for index, point in enumerate(region.vertices):
-            if isinstance(point, IntersectionClass): 
-            # vertices aren't visited twice
-                if region.vertices.count(point) > 1 and \
-                   index == region.vertices.index(point): 
-                    # only want to count the 1st time inter is visited
-                    region_num = Regions.index(region)
-                    new_edge = DirEdgeClass((region_num, region_num))
-                    edge_list.append(new_edge) # add self-loop!
-                    Nodes[region_num].edges.append(new_edge) #update self.edges
+    for index0, index1 in region_adjacency(Regions).tolist():
+        new_edge = DirEdgeClass((index0, index1))
+        edge_list.append(new_edge) # add edge b/w regions (or self-loop)
+        Nodes[index0].edges.append(new_edge) # update self.edges
+        if index1 != index0:
+            Nodes[index1].edges.append(new_edge)
     return edge_list
+
+def region_adjacency(Regions):
+    '''
+    Returns the edges of the graph associated with 'Regions' (list of 
+    RegionClass objects) as an int array with one row (index0, index1) per
+    edge, in the order of edges_regions: edges between different regions, 
+    sorted, then one self-loop for each intersection visited twice by a 
+    region, by region, at the first visit of the intersection.
+    
+    One pass over the vertices of the regions indexes each intersection to
+    the regions visiting it (two corners of each crossing are shaded, so 
+    at most two), instead of comparing every pair of regions.
+    '''
+    visits = {} # intersection -> {region index: number of visits}
+    loops = []
+    for region_num, region in enumerate(Regions):
+        first = [] # the intersections in the order of their 1st visit
+        for point in region.vertices:
+            if isinstance(point, IntersectionClass):
+                counts = visits.setdefault(point, {})
+                if region_num not in counts:
+                    first.append(point)
+                counts[region_num] = counts.get(region_num, 0) + 1
+        loops.extend((region_num, region_num) for point in first
+                     if visits[point][region_num] > 1)
+    pairs = {}
+    for counts in visits.itervalues():
+        regions = sorted(counts)
+        for i, index0 in enumerate(regions):
+            for index1 in regions[i + 1:]:
+                # each visit of index0 counts, as in RegionClass.num_inter
+                pairs[index0, index1] = pairs.get((index0, index1), 0) + \
+                                        counts[index0]
+    edges = [pair for pair in sorted(pairs) for inter in xrange(pairs[pair])]
+    return numpy.array(edges + loops, dtype=int).reshape(-1, 2)
+        
+def goeritz_form(Regions):
+    '''
+    Returns the quadratic form (numpy array) of the link with shaded regions
+    'Regions' (list of RegionClass objects) directly from the crossings, 
+    without a maximal subtree or circuits. It is isomorphic to the form of
+    quad_form.
+    
+    The form of quad_form is the lattice of cycles of the graph of the 
+    shaded regions. The graph is planar, so this is the lattice of cuts of
+    the dual graph, the graph of the unshaded regions with an edge for each
+    crossing: minus its Laplacian with the last row and column deleted
+    (the Goeritz matrix).
+    
+    The unshaded regions are found from the arcs of the boundaries of the 
+    shaded regions, from one intersection to the next. At each intersection
+    the arc leaving it along one shaded corner and the arc arriving at it 
+    along the other border the same unshaded corner, so joining these gives
+    the arcs around each unshaded region.
+    '''
+    # visits[inter] = [(region index, position in its list of intersections)]
+    crossings = [] # intersections of each region, in order
+    visits = {}
+    arcs = [] # arcs[index] + position is the arc leaving crossings[index][position]
+    for region_num, region in enumerate(Regions):
+        inters = [point for point in region.vertices if 
+                  isinstance(point, IntersectionClass)]
+        for position, inter in enumerate(inters):
+            visits.setdefault(inter, []).append((region_num, position))
+        arcs.append(sum(len(item) for item in crossings))
+        crossings.append(inters)
+    parent = range(sum(len(item) for item in crossings)) # union-find of arcs
+    def find(arc):
+        while parent[arc] != arc:
+            parent[arc] = parent[parent[arc]]
+            arc = parent[arc]
+        return arc
+    def arc(region_num, position):
+        return arcs[region_num] + position % len(crossings[region_num])
+    corners = [] # one pair of arcs on the unshaded corners of each crossing
+    for (region0, position0), (region1, position1) in visits.itervalues():
+        for leaving, arriving in [(arc(region0, position0), 
+                                   arc(region1, position1 - 1)),
+                                  (arc(region1, position1),
+                                   arc(region0, position0 - 1))]:
+            parent[find(leaving)] = find(arriving)
+        corners.append((arc(region0, position0), arc(region1, position1)))
+    roots = sorted(set(find(item) for item in xrange(len(parent))))
+    index = dict((root, number) for number, root in enumerate(roots))
+    edges = numpy.array([(index[find(arc0)], index[find(arc1)]) for 
+                         arc0, arc1 in corners], dtype=int).reshape(-1, 2)
+    edges = edges[edges[:, 0] != edges[:, 1]] # self-loops add nothing
+    size = len(roots)
+    quad = numpy.zeros((size, size), dtype=int)
+    numpy.add.at(quad, (edges[:, 0], edges[:, 1]), 1)
+    numpy.add.at(quad, (edges[:, 1], edges[:, 0]), 1)
+    quad -= numpy.diag(quad.sum(axis=1))
+    quad = quad[:-1, :-1]
+    assert is_negative_definite(quad)
+    return quad
         
 def maximal_subtree(edge_list, Nodes):
     '''
@@ -142,56 +225,50 @@ def maximal_subtree(edge_list, Nodes):
     Nodes -- a list of all the NodeClass objects for the graph.
              They need to have self.edges filled in by 'edges_regions'.
        
-    This function also updates the NodeClass.edge_path and NodeClass.path 
-    attributes for all NodeClass objects in Nodes.
+    This function also updates the NodeClass.parent, NodeClass.parent_edge and
+    NodeClass.depth attributes for all NodeClass objects in Nodes, so paths
+    in the tree are found by walking up the parent pointers (O(V + E) time 
+    and memory, instead of a path list for each node).
     '''    
     tree_edges = []  # all edges in the tree (DirEdgeClass objects)
-    tree_nodes = [0] # all nodes in tree (ints)
-    new_nodes = [0]  # new nodes to check
-    Nodes[0].path = [0]     # set starting node's path
-    Nodes[0].edge_path = [] # set starting node's edge_path
-    done = False
-    while done == False:
-        done = True
-        new_edges = []
-        for node in new_nodes[:]:
-            new_nodes.remove(node)
-            
-            # for each new node, check if any of the edges that aren't in the
-            # tree connect to it AND don't connect to anything already in tree
-            # (that would make a closed loop)
-            for edge in Nodes[node].edges:
-                # if we do have another edge leading away from the tree,
-                # add it to our tree and keep going (done = False)
-                if edge.edge[0] == node:
-                    other_node = edge.edge[1]
-                else:
-                    other_node = edge.edge[0]
-                if other_node not in tree_nodes: # add new node!
-                    Nodes[other_node].edge_path = Nodes[node].edge_path +[edge]
-                    Nodes[other_node].path = Nodes[node].path + [other_node]
-                    new_nodes.append(other_node)
-                    tree_nodes.append(other_node)                    
-                    new_edges.append(edge)
-                    done = False
-        tree_edges.extend(new_edges)
+    visited = [False] * len(Nodes)
+    visited[0] = True
+    Nodes[0].parent = Nodes[0].parent_edge = None # starting node is the root
+    Nodes[0].depth = 0
+    new_nodes = [0]  # nodes in the order reached
+    position = 0
+    while position < len(new_nodes): # breadth first
+        node = new_nodes[position]
+        position += 1
+        # for each new node, check if any of the edges connect to a node 
+        # not already in tree (else that would make a closed loop)
+        for edge in Nodes[node].edges:
+            if edge.edge[0] == node:
+                other_node = edge.edge[1]
+            else:
+                other_node = edge.edge[0]
+            if not visited[other_node]: # add new node!
+                visited[other_node] = True
+                Nodes[other_node].parent = Nodes[node]
+                Nodes[other_node].parent_edge = edge
+                Nodes[other_node].depth = Nodes[node].depth + 1
+                new_nodes.append(other_node)
+                tree_edges.append(edge)
     return tree_edges
 
 def minus_maximal_subtree(list_of_edges, subtree):
     '''
     Return a list of all edges that were not included in the maximal subtree.
     '''
-    all_edges_copy = list_of_edges[:]
-    for edge in subtree:
-        all_edges_copy.remove(edge)
-    return all_edges_copy
+    in_tree = set(subtree) # DirEdgeClass objects compare by identity
+    return [edge for edge in list_of_edges if edge not in in_tree]
         
         
 
 ############################
 # Quadratic Form functions #
 ############################
-def quad_form(tree, minus_edge_list, Nodes):
+def quad_form(tree, minus_edge_list, Nodes, engine='circuits', check=True):
     '''
     Returns the quadratic form (numpy array) associated with the graph and 
     maximal subtree.
@@ -203,7 +280,23 @@ def quad_form(tree, minus_edge_list, Nodes):
                        are NOT in the maximal subtree
     Nodes -- a list of all the NodeClass objects in the graph. All attributes
              should be updated by 'edges_regions' and 'maximal_subtree'.
+    engine -- 'circuits' to find each circuit once and get the form as 
+              -C C^T from circuit_matrix, 'pairs' to compare the circuits
+              of every pair of edges with shared_edges
+    check -- with 'circuits', assert that the shared edges of every two 
+             circuits have the same orientation, as shared_edges does
     '''
+    if engine == 'circuits':
+        circuits = circuit_matrix(tree, minus_edge_list, Nodes)
+        quad = -circuits.dot(circuits.T)
+        if check: # orientation must be consistent
+            unsigned = numpy.abs(circuits)
+            assert numpy.array_equal(unsigned.dot(unsigned.T), 
+                                     numpy.abs(quad))
+        assert is_negative_definite(quad)
+        return quad
+    if engine != 'pairs':
+        raise ValueError('Unknown engine %r' % engine)
     size = len(minus_edge_list)
     row = 0
     column = 0
@@ -225,6 +318,31 @@ def quad_form(tree, minus_edge_list, Nodes):
     assert is_negative_definite(quad)
     return quad
 
+def circuit_matrix(tree, minus_edge_list, Nodes):
+    '''
+    Returns an int array with a row for the circuit (see circuit) of each 
+    edge in 'minus_edge_list', as a signed vector over the edges of the 
+    graph: 1 for the edges of circuit[0], -1 for the (reversed) edges of
+    circuit[1], 0 for the rest. Only the columns of edges on some circuit
+    are kept.
+    
+    Two circuits share an edge in the same direction when the product of
+    their entries is 1, so shared_edges(c1, c2) is -(row 1).(row 2).
+    '''
+    columns = {} # DirEdgeClass -> column
+    rows = []
+    for edge in minus_edge_list:
+        forward, backward = circuit(tree, edge, Nodes)
+        rows.append([(columns.setdefault(y, len(columns)), 1) 
+                     for y in forward] + 
+                    [(columns.setdefault(y, len(columns)), -1) 
+                     for y in backward])
+    circuits = numpy.zeros((len(rows), len(columns)), dtype=int)
+    for index, entries in enumerate(rows):
+        for column, sign in entries:
+            circuits[index, column] = sign
+    return circuits
+
 def symmetric(array):
     '''
     Takes an upper triangular square numpy array, and copies the upper 
@@ -236,17 +354,17 @@ def symmetric(array):
     size = array.shape[0]
     if size != array.shape[1]:
         raise ValueError('not a square matrix')
-    for row in range(size):
-        for column in range(size):
-            if row > column: # lower triangle
-                assert array[row][column] == 0
-                array[row][column] = array[column][row]
+    assert not numpy.tril(array, -1).any() # lower triangle
+    array += numpy.triu(array, 1).T
 
 def is_negative_definite(quad):
     '''
     Return True if square matrix/array 'quad' is negative definite
-    (all eigenvalues negative), False otherwise.
+    (all eigenvalues negative), False otherwise. For a SparseForm, see 
+    SparseForm.is_negative_definite.
     '''
+    if isinstance(quad, SparseForm):
+        return quad.is_negative_definite()
     eigenvalues = LA.eigvalsh(quad)
     for eigen in eigenvalues:
         if eigen >= 0:
@@ -266,15 +384,13 @@ def circuit(tree, edge, Nodes):
     node2 -> common_ancestor. In this list, the coordinates of each edge
     (edge.edge) are the reverse of the direction actually traversed.
     '''
-    node1 = edge.edge[0]
-    node2 = edge.edge[1]
-    ancestor = Nodes[node1].last_ancestor(Nodes[node2])
-    index1 = Nodes[node1].path.index(ancestor)
-    index2 = Nodes[node2].path.index(ancestor)
+    node1 = Nodes[edge.edge[0]]
+    node2 = Nodes[edge.edge[1]]
+    ancestor = node1.last_ancestor(node2)
     
-    edge_path1 = Nodes[node1].edge_path[index1:] # common_ancestor -> node1
-    edge_path2 = Nodes[node2].edge_path[index2:] # common_ancestor -> node2
-    edge_path2.reverse() # opposite order - want node2 -> common_ancestor
+    edge_path1 = node1.edges_to(ancestor)
+    edge_path1.reverse() # want common_ancestor -> node1
+    edge_path2 = node2.edges_to(ancestor) # node2 -> common_ancestor
     return (edge_path1 + [edge], edge_path2)
 
 
@@ -329,6 +445,8 @@ def usage():
     sys.exit(1)    
 
 if __name__ == '__main__':
+    from plink_load import load_plink, make_objects
+    from knotilus_load import load
     if len(sys.argv) == 2:
         if sys.argv[1] == '-p': # Plink
             data = load_plink()
@@ -14,20 +14,19 @@ import tkFileDialog, tkMessageBox, tkFont, ttk
 import ImageTk, Image
 import tkHyperlinkManager
 from graph_quad import *
+from plink_load import load_plink, make_objects
+from knotilus_load import load
 from knotilus_download import valid_archive_form, browser_link
 from seifert import s_quad_form, correct_form, s_draw, alter_data, make_graph, \
-     parse_seifert
+     parse_seifert, s_corr_terms
 from weighted_graph import GraphPopup
 from gui_output import OutputWindow
 from ndqf import NDQF
+from term_cache import default_cache
 
 def regions_to_quad(regions):
     '''Return quadratic form (numpy array) given list of RegionClass objects'''
-    Nodes = [NodeClass(i) for i in range(len(regions))]
-    t = edges_regions(Nodes,regions)
-    m = maximal_subtree(t, Nodes)
-    minus = minus_maximal_subtree(t, m)
-    return quad_form(t, minus, Nodes)
+    return goeritz_form(regions)
 
 class StartWindow(Frame):
     def __init__(self, master):        
@@ -248,7 +247,8 @@ class KnotilusBox(object):
         quad = regions_to_quad(regions)
         print quad
         quadform = NDQF(quad)
-        corr = quadform.correction_terms(self.use_multi.get())
+        corr = quadform.correction_terms(self.use_multi.get(),
+                                         cache=default_cache())
         struct = quadform.group.struct()
         
         if self.condense.get():
@@ -375,7 +375,8 @@ class PLinkBox(object):
             quadform = NDQF(quad)
             struct = quadform.group.struct()
             print struct            
-            corr = quadform.correction_terms(self.use_multi.get())
+            corr = quadform.correction_terms(self.use_multi.get(),
+                                             cache=default_cache())
         else: # unknot with no crossings
             quad = 'N/A (unknot with no crossings)'
             corr = '0' # only 1 spin structure
@@ -440,8 +441,9 @@ class SeifertBox(object):
         self.show_weighted = show_weighted # intvar
         self.show_seifert = show_seifert # intvar
         self.condense = condense # intvar
-        self.use_multi = use_multi
+        self.use_multi = use_multi # for the search of the check
         self.save_file = IntVar()
+        self.check = IntVar() # check against the quadratic form search
         
         sframe = LabelFrame(master, text='Seifert data', font=section_font, \
                             padx=5, pady=5)
@@ -450,8 +452,10 @@ class SeifertBox(object):
         text.grid(row=0, column=0)
         Checkbutton(sframe, text='Save\ngraph', variable=self.save_file).grid(\
             row=0, column=2)
+        Checkbutton(sframe, text='Check', variable=self.check).grid(row=0, \
+                                                                    column=3)
         Button(sframe, text='Go', command=self.get_seifert).grid(row=0, \
-                                                                 column=3)
+                                                                 column=4)
         self.entry = Entry(sframe, width=17)
         self.entry.grid(row=0, column=1)
         
@@ -486,10 +490,14 @@ class SeifertBox(object):
             quadform = NDQF(quad[0])
             struct = quadform.group.struct()
             print struct
-            if self.use_multi.get():
-                corr = quadform.correction_terms_threaded()
-            else:
-                corr = quadform.correction_terms_ugly()
+            try:
+                corr = s_corr_terms(data, quadform, cache=default_cache(),
+                                    check=self.check.get(), 
+                                    multiprocessing=self.use_multi.get())
+            except RuntimeError as error: # the check failed
+                tkMessageBox.showwarning('Check failed', str(error))
+                print traceback.print_exc()
+                return
             if quad[1]: # reversed orientation
                 corr = map(lambda n: -n, corr)
             corr = quadform.pretty_print(corr) # make Fractions pretty
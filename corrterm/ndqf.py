@@ -1,15 +1,18 @@
 # FILE: ndqf.py
 
 import numpy as np
-from smith import smith_normal_form
+from smith import smith_normal_form, exact_smith_normal_form
 from fractions import Fraction, gcd
 from sys import maxint
 import time # timing
-from multiprocessing import Pool, Manager
-import functools
+import math
+from multiprocessing import Pool, cpu_count
 
-PROCESSES = None # number of processes in pool. 
-# None => default is number of cpus counted
+BLOCK_SIZE = 2**14 # number of alphas per block in AlphaRange.blocks
+SHARDS_PER_PROCESS = 4 # ranges of the box per process, to balance the load
+AUTO_BOX_LIMIT = 10**6 # 'auto' iterates through half boxes up to this size
+PRUNE_TOLERANCE = 1e-6 # largest relative error 'auto' lets the pruned search
+                       # make up for (see prune_slack)
 
 #from memory_profiler import profile
 
@@ -17,9 +20,20 @@ PROCESSES = None # number of processes in pool.
 
 def mod2(x, y): return (x - y) % 2
 
-def process_alpha_outside(cls, representatives, alpha, lst):
-    cls.process_alpha(representatives, lst, alpha)
-    # for multiprocessing, can't pickle unless fcn is at top level of module
+_shard_form = None # the NDQF each worker process searches
+
+def init_shard_worker(form):
+    '''Pool initializer: keeps the quadratic form in the worker process, so 
+    it is pickled once per process instead of once per shard.'''
+    global _shard_form
+    _shard_form = form
+
+def shard_maxes(bounds):
+    '''Returns the array of class maxima over the range 'bounds' 
+    (start, stop) of the box. For multiprocessing, can't pickle unless 
+    fcn is at top level of module.'''
+    start, stop = bounds
+    return _shard_form.box_maxes(start, stop)
 
 def nontrivial(mat):
     return np.matrix.copy(mat[mat!=1])
@@ -39,10 +53,57 @@ class NDQF(object):
                 return 0
             else:
                 return Fraction(1, n)
-        new_left = np.rint(right.I).astype(int) # inverse of right
-        new_right = np.rint(left.I).astype(int) # inverse of left
-        # right, left unimodular => inverse is also an integer matrix
+        new_left = cls.unimodular_inverse(right) # inverse of right
+        new_right = cls.unimodular_inverse(left) # inverse of left
         return new_left * np.vectorize(flip)(diag) * new_right
+
+    @classmethod
+    def unimodular_inverse(cls, mat):
+        '''Returns the inverse of the unimodular matrix 'mat', which is
+        also an integer matrix.'''
+        inverse, denom = cls.exact_inverse(mat)
+        assert denom == 1 # unimodular
+        return inverse
+
+    @classmethod
+    def exact_inverse(cls, mat):
+        '''
+        Returns (int_mat, denom) such that int_mat = denom * mat^(-1), for a
+        nonsingular integer matrix 'mat', with denom > 0 as small as possible.
+        Same as int_matrix(rational_inverse(...)), but without floating point 
+        inverses or Fractions.
+        
+        Fraction-free (Bareiss) Gauss-Jordan elimination on [mat | I] ends at
+        [d*I | d*mat^(-1)] with d = +-det(mat), and every division is exact.
+        int_mat is an int64 matrix if its entries fit, otherwise it has 
+        Python ints (dtype object).
+        '''
+        size = mat.shape[0]
+        work = np.hstack((np.asarray(mat).astype(object), 
+                          np.eye(size, dtype=int).astype(object)))
+        previous = 1
+        for k in xrange(size):
+            if work[k, k] == 0: # swap in a row with a nonzero pivot
+                rows = [i for i in xrange(k + 1, size) if work[i, k] != 0]
+                if not rows:
+                    raise ValueError('Singular matrix has no inverse.')
+                work[[k, rows[0]]] = work[[rows[0], k]]
+            pivot_row = work[k].copy()
+            # row i -> (pivot * row i - work[i, k] * pivot row) / previous 
+            work = (pivot_row[k] * work - 
+                    np.outer(work[:, k], pivot_row)) // previous
+            work[k] = pivot_row
+            previous = pivot_row[k]
+        det = work[size - 1, size - 1]
+        assert np.all(np.diagonal(work[:, :size]) == det)
+        inverse = work[:, size:]
+        common = abs(reduce(gcd, inverse.flat, det))
+        if det < 0:
+            common = -common
+        inverse = inverse // common
+        if np.all(np.abs(inverse) < 2**63):
+            inverse = inverse.astype(np.int64)
+        return np.asmatrix(inverse), det // common
     
     @classmethod
     def int_matrix(cls, mat, size):
@@ -76,12 +137,15 @@ class NDQF(object):
         self.mat = m
         self.b = self.mat.shape[0]
         self.diagonal = (-np.diagonal(self.mat)).tolist()
-        d, (u, v) = smith_normal_form(m)
+        d, (u, v) = exact_smith_normal_form(m)
         self.decomp = (d, (u, v))
-        self.mat_inverse = NDQF.rational_inverse(d, u, v)
-        self.int_inverse = NDQF.int_matrix(self.mat_inverse, self.b)
+        self.int_inverse = NDQF.exact_inverse(m)
+        int_mat, denom = self.int_inverse
+        self.mat_inverse = np.asmatrix(np.vectorize(
+            lambda n: Fraction(int(n), denom), otypes=[object])(int_mat))
         self.compute_affine_space()
         self.compute_homology()
+        self.compute_class_key()
          
     def eval2(self, u, v, inverse=False):
         '''Evaluates the quadratic form on the vectors u and v. They should
@@ -115,10 +179,109 @@ class NDQF(object):
         D, (U, V) = self.decomp
         self.group = Hom_Group(D, V)
        
+    def compute_class_key(self):
+        '''Sets up the map from characteristic vectors to the index of their
+        Spin^c class, in the order given by lrange(self.group.structure).
+        
+        alpha ~ rep(c) <=> (alpha - basepoint)/2 = sum c_k gen_k in H_1(Y),
+        and sum c_k gen_k = V^T (0, ..., 0, c), so the coefficients c_k are
+        recovered from (V^T)^(-1) reduced modulo the invariant factors.'''
+        D, (U, V) = self.decomp
+        structure = self.group.structure
+        start = self.b - len(structure)
+        inverse_t = np.asarray(NDQF.unimodular_inverse(V)).T
+        self.class_orders = np.array(structure, dtype=int)
+        # rows: coefficient c_k, reduced mod its order (exactly, as V may be
+        # an object array), so the entries fit the dtype of class_orders
+        self.class_map = np.array([[int(entry) % int(order) for entry in row]
+                                   for row, order in 
+                                   zip(inverse_t[start:].tolist(), structure)],
+                                  dtype=self.class_orders.dtype).reshape(
+                                      len(structure), self.b)
+        # lrange is 'read' with the first coefficient most significant
+        strides = [1 for i in xrange(len(structure))]
+        for i in xrange(len(structure) - 2, -1, -1):
+            strides[i] = strides[i + 1] * structure[i + 1]
+        self.class_strides = np.array(strides, dtype=int)
+        self.num_classes = reduce(lambda x, y: x*y, structure, 1)
+        # -alpha is characteristic with the same |alpha|^2, and 
+        # (-alpha - basepoint)/2 = -(alpha - basepoint)/2 - basepoint, so
+        # the conjugate class has coefficients shift - c. Nothing is built
+        # per class here: H_1(Y) may be far too large to list.
+        self.conjugate_shift = (self.class_map.dot(-self.basepoint) % 
+                                self.class_orders).tolist()
+
+    def class_coefs(self, alpha):
+        '''Returns the coefficients [c_0, c_1, ...] of the class of the
+        characteristic vector 'alpha', i.e. alpha ~ self.find_rep(coefs).'''
+        w = (np.asarray(alpha).ravel() - self.basepoint) // 2
+        return (self.class_map.dot(w) % self.class_orders).tolist()
+
+    def class_index(self, alpha):
+        '''
+        Returns the index of the Spin^c class of the characteristic vector
+        'alpha' in the list of representatives built from 
+        lrange(self.group.structure). Same result as equiv_class, but
+        without scanning the representatives.
+        '''
+        w = (np.asarray(alpha).ravel() - self.basepoint) // 2
+        coefs = self.class_map.dot(w) % self.class_orders
+        return int(coefs.dot(self.class_strides))
+
+    def conjugate_index(self, index):
+        '''Returns the index of the conjugate class of the class number
+        'index', i.e. the class of -alpha for alpha in the class: its 
+        coefficients are (shift - c) % class_orders.'''
+        conjugate = 0
+        for shift, order, stride in zip(self.conjugate_shift, 
+                                        self.group.structure,
+                                        self.class_strides.tolist()):
+            coef = (index // stride) % order
+            conjugate += ((shift - coef) % order) * stride
+        return conjugate
+
+    def conjugate_indices(self):
+        '''Returns the array of conjugate_index of every class, in O(|H_1|),
+        for the engines that go through all the classes anyway.'''
+        coefs = (np.arange(self.num_classes)[:, np.newaxis] // 
+                 self.class_strides) % self.class_orders
+        return ((np.array(self.conjugate_shift, dtype=int) - coefs) % 
+                self.class_orders).dot(self.class_strides)
+    
+    def self_conjugate(self):
+        '''Returns the (sorted) indices of the self-conjugate classes, i.e. 
+        the Spin^c structures coming from spin structures. These are the 
+        solutions of 2c = shift mod each order, so only the 2-torsion
+        is enumerated: one solution for an odd order n (shift (n + 1)/2),
+        two (shift/2 and shift/2 + n/2) for an even one.'''
+        indices = [0]
+        for shift, order, stride in zip(self.conjugate_shift, 
+                                        self.group.structure,
+                                        self.class_strides.tolist()):
+            if order % 2:
+                coefs = [shift * ((order + 1) // 2) % order]
+            elif shift % 2:
+                return []
+            else:
+                coefs = [shift // 2, shift // 2 + order // 2]
+            indices = [index + coef * stride for index in indices 
+                       for coef in coefs]
+        return sorted(indices)
+    
+    def symmetrize(self, maxes):
+        '''
+        Returns the list of class maxima 'maxes' combined with the maxima of
+        the conjugate classes. |-alpha|^2 = |alpha|^2, and -alpha is in the 
+        conjugate class, so maxima over half of a box symmetric under 
+        alpha -> -alpha give the maxima over the whole box.
+        '''
+        return [max(maxes[index], maxes[conjugate]) for index, conjugate in
+                enumerate(self.conjugate_indices().tolist())]
+
     def compute_affine_space(self):
         '''Finds the basepoint of the affine space associated to the 
         quadratic form. The rest can be found by the action of the group.'''
-        self.basepoint = np.diagonal(self.mat) % 2
+        self.basepoint = np.asarray(np.diagonal(self.mat) % 2, dtype=int)
 
     def find_abs(self, alpha):
         '''Find the absolute value |alpha|^2 for the matrix, that is
@@ -132,67 +295,444 @@ class NDQF(object):
         unsummed = [2 * c * g for (c, g) in zip(coef_list, self.group.gen)]
         return self.basepoint + sum(unsummed)
     
-    def process_alpha(self, representatives, alpha, lst):
-        if map(mod2, self.diagonal, alpha) == [0 for i in xrange(self.b)]:
-            class_index = self.equiv_class(alpha, representatives)
-            magnitude = self.find_abs(alpha)
-            if magnitude > lst[class_index]:
-                lst[class_index] = magnitude
-                # if get IndexError above, probably b/c did NOT find equiv class,
-                # i.e. class_index went too high           
-                
     def correction_terms_ugly(self):
         '''Finds the correction terms assoctiated to the quadratic form,
         for each of the equivalance classes it finds the maximum by
         iterating through the relation vectors of the group.'''
         print 'Not using multiprocessing'
         start_time = time.time()
-        coef_lists = lrange(self.group.structure)
-        # representatives = elements of C_1(V) (np.matrix)
-        representatives = map(lambda l: self.find_rep(l), coef_lists)
-        listofmaxes = [None for i in xrange(len(representatives))]
-        alphagen = self.get_alpha()
-        for alpha in alphagen:
-            # check if a_i = Q(e_i,e_i) (mod 2)
-            if map(mod2, self.diagonal, alpha) == [0 for i in xrange(self.b)]:
-                class_index = self.equiv_class(alpha, representatives)
-                int_magnitude = self.find_abs(alpha)
-                if int_magnitude > listofmaxes[class_index]:
-                    listofmaxes[class_index] = int_magnitude
-                # if get IndexError above, probably b/c did NOT find equiv class,
-                # so class_index too high
+        listofmaxes = [None for i in xrange(self.num_classes)]
+        # only alphas with a_i = Q(e_i,e_i) (mod 2), and only half of them;
+        # the other half are their negatives
+        alphagen = self.get_alpha(characteristic=True, half=True)
+        for alpha, class_index, int_magnitude in self.walk(alphagen):
+            if int_magnitude > listofmaxes[class_index]:
+                listofmaxes[class_index] = int_magnitude
+        listofmaxes = self.symmetrize(listofmaxes)
         # get corrterms via (|alpha|^2+b)/4
         print 'Computed from quadratic form in %g seconds' \
               % (time.time() - start_time)        
         return [Fraction(Fraction(alpha, self.int_inverse[1]) + self.b, 4) \
                 for alpha in listofmaxes]
     
-    #@profile
-    def correction_terms_threaded(self):
+    def walk(self, alphas):
+        '''
+        Generates (alpha, class index, |alpha|^2 numerator) for each vector
+        alpha of the AlphaRange 'alphas' of characteristic vectors, in order.
+        alpha is the same list each time, changed in place.
+
+        Consecutive alphas differ by a step in one coordinate, after the
+        coordinates before it wrap around (less than one per alpha on
+        average). Changing a_i by d adds d Q^(-1)e_i to Q^(-1)alpha,
+        d(2(Q^(-1)alpha)_i + d Q^(-1)_ii) to |alpha|^2 and (d/2) class_map e_i
+        to the class coefficients, so each alpha costs O(b) instead of the
+        O(b^2) of find_abs and class_index.
+        '''
+        if alphas.start >= alphas.stop:
+            return
+        inverse = np.asarray(self.int_inverse[0]).tolist() # symmetric
+        class_rows = np.asarray(self.class_map).tolist()
+        class_columns = np.asarray(self.class_map).T.tolist()
+        orders = self.class_orders.tolist()
+        strides = self.class_strides.tolist()
+        alpha = alphas.vector(alphas.start)
+        image = [sum(q * a for q, a in zip(row, alpha)) for row in inverse]
+        magnitude = sum(a * y for a, y in zip(alpha, image))
+        basepoint = np.asarray(self.basepoint).ravel().tolist()
+        w = [(a - p) // 2 for a, p in zip(alpha, basepoint)]
+        coefs = [sum(m * x for m, x in zip(row, w)) % order
+                 for row, order in zip(class_rows, orders)]
+        index = sum(c * s for c, s in zip(coefs, strides))
+        lows, highs, steps = alphas.lows, alphas.highs, alphas.steps
+        for number in xrange(alphas.stop - alphas.start - 1):
+            yield alpha, index, magnitude
+            i = 0
+            while True:
+                if alpha[i] == highs[i]: # carry
+                    change = lows[i] - highs[i]
+                else:
+                    change = steps[i]
+                if change:
+                    magnitude += change * (2 * image[i] +
+                                           change * inverse[i][i])
+                    image = [y + change * q for y, q in zip(image, inverse[i])]
+                    coefs = [(c + change // 2 * m) % order for c, m, order in
+                             zip(coefs, class_columns[i], orders)]
+                    alpha[i] += change
+                if change > 0:
+                    break
+                i += 1
+            index = sum(c * s for c, s in zip(coefs, strides))
+        yield alpha, index, magnitude
+
+    def correction_terms_threaded(self, processes=None):
         '''Finds the correction terms assoctiated to the quadratic form,
         for each of the equivalance classes it finds the maximum by 
         iterating through the relation vectors of the group. 
         
-        Uses multiprocessing.'''
+        Uses multiprocessing: the box is split into contiguous ranges, each 
+        worker keeps the class maxima of its ranges (box_maxes), and the
+        maxima are combined at the end.
+        processes - number of worker processes; None => cpu_count()'''
         print 'Using multiprocessing'
-        pool = Pool() # default: processes=None => uses cpu_count()
-        manager = Manager()
         start_time = time.time()
-        coef_lists = lrange(self.group.structure)
-        # representatives = elements of C_1(V) (np.matrix)
-        representatives = map(lambda l: self.find_rep(l), coef_lists)
-        # list of maxes        
-        lst = manager.list([None for i in xrange(len(representatives))]) 
-        alphalist = list(self.get_alpha()) # cannot pickle generators
-        pool.map_async(functools.partial(process_alpha_outside, self, 
-                                         representatives, lst), alphalist)
-        pool.close()
-        pool.join() # wait for pool to finish
+        if processes is None:
+            processes = cpu_count()
+        total = len(self.get_alpha(characteristic=True, half=True))
+        num_shards = processes * SHARDS_PER_PROCESS
+        cuts = [total * i // num_shards for i in xrange(num_shards + 1)]
+        shards = [(cuts[i], cuts[i + 1]) for i in xrange(num_shards) \
+                  if cuts[i] < cuts[i + 1]]
+        pool = Pool(processes, init_shard_worker, (self,))
+        try:
+            maxes = reduce(np.maximum, pool.map(shard_maxes, shards))
+        finally:
+            pool.close()
+            pool.join() # wait for pool to finish
+        maxes = self.symmetrize(maxes)
+        # get corrterms via (|alpha|^2+b)/4
+        print 'Computed from quadratic form in %g seconds' \
+              % (time.time() - start_time)
+        return [Fraction(Fraction(int(alpha), self.int_inverse[1]) + self.b, 4)\
+                for alpha in maxes]
+
+    def correction_terms_batch(self, block_size=BLOCK_SIZE):
+        '''Finds the correction terms associated to the quadratic form, 
+        for each of the equivalence classes it finds the maximum by iterating
+        through the box from max_bounds in blocks (get_alpha_blocks), 
+        evaluating each block with a few numpy operations.'''
+        print 'Using numpy blocks'
+        start_time = time.time()
+        half = len(self.get_alpha(characteristic=True, half=True))
+        maxes = self.symmetrize(self.box_maxes(0, half, block_size))
+        # get corrterms via (|alpha|^2+b)/4
+        print 'Computed from quadratic form in %g seconds' \
+              % (time.time() - start_time)
+        return [Fraction(Fraction(int(alpha), self.int_inverse[1]) + self.b, 4)\
+                for alpha in maxes]
+
+    def fits_int64(self):
+        '''
+        Returns True if the numpy engines (box_maxes) can work in int64. Over
+        the box from max_bounds, |a_i| <= -Q(e_i,e_i) <= m, so the entries of
+        alpha Q^(-1) are at most b m max|Q^(-1)_ij|, |alpha|^2 (numerator)
+        at most b m times that, and the class coefficients (before reducing)
+        at most b m max|class_map| (class_map is reduced mod the orders); all
+        must be below 2^62.
+        '''
+        inverse = np.asarray(self.int_inverse[0])
+        class_map = np.asarray(self.class_map)
+        if inverse.dtype == object or class_map.dtype == object:
+            return False
+        largest = self.b * max(self.diagonal + [1])
+        image = largest * max(int(np.abs(inverse).max()) if inverse.size else 0, 
+                              1)
+        coefs = largest * (int(np.abs(class_map).max()) if class_map.size 
+                           else 0)
+        return largest * image < 2**62 and coefs < 2**62
+
+    def box_maxes(self, start=0, stop=None, block_size=BLOCK_SIZE):
+        '''Returns an array with the maximum |alpha|^2 (numerator) of each 
+        class, over the alphas number start to stop of 
+        get_alpha(characteristic=True): int64 from numpy blocks if 
+        fits_int64, else Python ints (dtype object) from walk, with -inf for
+        the classes not met.'''
+        if not self.fits_int64():
+            maxes = np.empty(self.num_classes, dtype=object)
+            maxes.fill(float('-inf'))
+            alphas = self.get_alpha(start, stop, characteristic=True)
+            for alpha, index, magnitude in self.walk(alphas):
+                if magnitude > maxes[index]:
+                    maxes[index] = magnitude
+            return maxes
+        inverse = np.asarray(self.int_inverse[0], dtype=np.int64)
+        basepoint = np.asarray(self.basepoint, dtype=np.int64)
+        class_map_t = np.asarray(self.class_map, dtype=np.int64).T
+        # smaller than any |alpha|^2; classes not met in the range keep it
+        maxes = np.empty(self.num_classes, dtype=np.int64)
+        maxes.fill(np.iinfo(np.int64).min)
+        for block in self.get_alpha_blocks(block_size, start, stop, 
+                                           characteristic=True):
+            magnitudes = (block.dot(inverse) * block).sum(axis=1)
+            coefs = ((block - basepoint) // 2).dot(class_map_t) 
+            class_indices = (coefs % self.class_orders).dot(self.class_strides)
+            np.maximum.at(maxes, class_indices, magnitudes)
+        return maxes
+
+    def class_bound(self, magnitude):
+        '''
+        Returns an upper bound for |alpha|^2 (numerator) over the class of a
+        characteristic vector with |alpha|^2 = magnitude (numerator).
+
+        |alpha + 2Qz|^2 - |alpha|^2 = 4(alpha.z + zQz), and 
+        alpha.z + zQz = sum Q(e_i,e_i) z_i + zQz = 0 (mod 2), so |alpha|^2 is 
+        fixed modulo 8 across the class; it is also at most 0.
+        '''
+        period = 8 * self.int_inverse[1]
+        return magnitude % period - period if magnitude % period else 0
+
+    def correction_terms_bounded(self):
+        '''Finds the correction terms associated to the quadratic form, 
+        for each of the equivalence classes it finds the maximum by iterating
+        through the box from max_bounds in bands of increasing sum a_i^2
+        (get_alpha_band), where |alpha|^2 tends to be largest, and stops once
+        no alpha left in the box can beat any class maximum:
+        - a class is done when its maximum reaches class_bound, or
+        - -Q has no eigenvalue above the largest row sum r of |Q(e_i,e_j)|
+          (Gershgorin), so |alpha|^2 <= -sum a_i^2 / r for the rest.
+        The bands are int64 numpy arrays; if that could overflow 
+        (fits_int64), the whole box is walked instead 
+        (correction_terms_ugly).'''
+        if not self.fits_int64():
+            print 'Too large for int64, walking the box'
+            return self.correction_terms_ugly()
+        print 'Using bands of the box with class bounds'
+        start_time = time.time()
+        inverse = np.asarray(self.int_inverse[0], dtype=np.int64)
+        denom = self.int_inverse[1]
+        basepoint = np.asarray(self.basepoint, dtype=np.int64)
+        class_map_t = np.asarray(self.class_map, dtype=np.int64).T
+        rowsum = max(sum(abs(n) for n in row) for row in self.mat.tolist())
+        bounds = [self.class_bound(int(self.find_abs(self.find_rep(coefs))))
+                  for coefs in lrange(self.group.structure)]
+        maxes = np.empty(self.num_classes, dtype=np.int64)
+        maxes.fill(np.iinfo(np.int64).min)
+        largest = sum(ndiag * ndiag for ndiag in self.diagonal)
+        visited = 0
+        low, high = -1, 0
+        while True:
+            band = self.get_alpha_band(low, high)
+            visited += len(band)
+            if len(band):
+                magnitudes = (band.dot(inverse) * band).sum(axis=1)
+                coefs = ((band - basepoint) // 2).dot(class_map_t)
+                class_indices = (coefs % self.class_orders).dot(
+                    self.class_strides)
+                np.maximum.at(maxes, class_indices, magnitudes)
+            # the alphas left have sum a_i^2 > high
+            beyond = -(high + 1) * denom
+            if high >= largest or all(m == bound or m * rowsum >= beyond 
+                                      for m, bound in 
+                                      zip(maxes.tolist(), bounds)):
+                break
+            # sum a_i^2 has the parity of sum Q(e_i,e_i), so bands are even
+            low, high = high, high + 2 * self.b
+        total = len(self.get_alpha(characteristic=True))
+        print 'Visited %i of %i characteristic vectors (%.3g%%)' \
+              % (visited, total, 100.0 * visited / total)
+        # get corrterms via (|alpha|^2+b)/4
+        print 'Computed from quadratic form in %g seconds' \
+              % (time.time() - start_time)
+        return [Fraction(Fraction(int(alpha), self.int_inverse[1]) + self.b, 4)\
+                for alpha in maxes]
+
+    def descend(self, alpha):
+        '''
+        Returns a characteristic vector in the same class as 'alpha' with
+        |a_i| <= -Q(e_i,e_i), and |alpha|^2 at least as large.
+        
+        alpha + 2kQe_i is in the same class as alpha, and 
+        |alpha + 2kQe_i|^2 = |alpha|^2 + 4k(a_i + kQ(e_i,e_i)), which increases
+        when k is the nearest integer to a_i / (-2Q(e_i,e_i)) and a_i is 
+        outside the bounds.
+        '''
+        alpha = np.array(alpha).ravel()
+        rows = np.asarray(self.mat)
+        done = False
+        while not done:
+            done = True
+            for i, ndiag in enumerate(self.diagonal):
+                if -ndiag <= alpha[i] <= ndiag:
+                    continue
+                k = (alpha[i] + ndiag) // (2 * ndiag)
+                alpha = alpha + 2 * k * rows[i]
+                done = False
+        return alpha
+
+    def search_order(self):
+        '''
+        Returns a permutation of range(self.b) in which to search the
+        coordinates of the lattice ZZ^b with the form -Q, last to first.
+        
+        The coordinate searched first should have the fewest possible values:
+        the one with the smallest variance (-Q^(-1))_kk. Fixing it conditions
+        the rest, so pick greedily from the Schur complement.
+        '''
+        var = -np.asarray(self.int_inverse[0], dtype=float) / self.int_inverse[1]
+        remaining = range(self.b)
+        order = []
+        while remaining:
+            k = min(remaining, key=lambda k: var[k, k])
+            remaining.remove(k)
+            order.append(k)
+            var = var - np.outer(var[:, k], var[k, :]) / var[k, k]
+        order.reverse()
+        return order
+
+    def prune_slack(self):
+        '''
+        Returns a bound on the relative error of the floating point values of
+        -zQz in correction_terms_pruned: the Cholesky factor computed in 
+        floating point is exact for -Q + E with |E| <= c b eps |Q| (backward
+        error), which changes -zQz by at most |E| / lambda_min relative to 
+        it, so 8 b eps cond(-Q) with a margin for the other roundings.
+        '''
+        eigenvalues = np.linalg.eigvalsh(-np.asarray(self.mat, dtype=float))
+        if len(eigenvalues) == 0:
+            return 0.0
+        if eigenvalues[0] <= 0:
+            return float('inf')
+        return 8 * self.b * np.finfo(float).eps * \
+               eigenvalues[-1] / eigenvalues[0]
+
+    def correction_terms_pruned(self):
+        '''Finds the correction terms associated to the quadratic form by
+        searching each equivalence class separately, pruning every branch 
+        that cannot beat the maximum found so far for that class 
+        (Fincke-Pohst enumeration).
+        
+        A branch is cut when its floating point lower bound on the class
+        maximum is above the bound for beating the maximum by 1 (values are
+        ints) by more than the relative error from prune_slack, so no
+        branch that can improve a maximum is cut.
+        
+        The class of alpha is alpha + 2Qz for z in ZZ^b, and with 
+        x = Q^(-1)alpha, |alpha + 2Qz|^2 = 4(z + x/2)Q(z + x/2). So each class
+        maximum is a closest vector problem for -Q, which is sparse with small
+        entries, and only characteristic vectors are ever generated. Branches 
+        are also cut once a coordinate of alpha is determined and lies outside
+        the box from max_bounds, since every class has a maximum in the box.'''
+        print 'Using pruned lattice search'
+        start_time = time.time()
+        inverse = np.asarray(self.int_inverse[0])
+        denom = self.int_inverse[1]
+        # search the coordinates in the order from search_order, and use 
+        # 'rows' for the form in that order
+        order = self.search_order()
+        mat = np.asarray(self.mat)
+        rows = mat[np.ix_(order, order)]
+        columns = mat[:, order]
+        # -zQz = sum_i diag[i] * (z_i + sum_{j>i} coefs[i][j] * z_j)^2
+        chol = np.linalg.cholesky(-rows.astype(float))
+        diag = (np.diagonal(chol) ** 2).tolist()
+        coefs = (chol / np.diagonal(chol)).T.tolist()
+        # a_k = rep_k + 2(Qz)_k is known once z_j is fixed for all j with 
+        # Q(e_k,e_j) != 0, i.e. at level min_j; it must lie in the box
+        int_rows = rows.tolist()
+        support = [[j for j in xrange(self.b) if int_rows[k][j]] \
+                   for k in xrange(self.b)]
+        box_checks = [[] for i in xrange(self.b)]
+        for k in xrange(self.b):
+            box_checks[min(support[k])].append(k)
+        ndiags = [self.diagonal[k] for k in order]
+        slack = 1 + self.prune_slack()
+        listofmaxes = []
+        for index, coef_list in enumerate(lrange(self.group.structure)):
+            conjugate = self.conjugate_index(index)
+            if conjugate < index: # same maximum as conjugate
+                listofmaxes.append(listofmaxes[conjugate])
+                continue
+            rep = self.descend(self.find_rep(coef_list))
+            best = [rep, int(rep.dot(inverse).dot(rep))]
+            # scaled so the form compares directly with -|alpha|^2 / denom 
+            target = (-inverse.dot(rep) / (2.0 * denom))[order].tolist()
+            rep_list = rep[order].tolist()
+            z = [0 for i in xrange(self.b)]
+            
+            def bound():
+                # magnitudes are ints, so only values at least 1 better 
+                # matter, i.e. -|alpha|^2 / (4 denom) <= (-best - 1) / 
+                # (4 denom); 'slack' covers the relative rounding error
+                return (-best[1] - 0.5) / (4.0 * denom) * slack
+            
+            def search(i, partial):
+                center = target[i] - sum(coefs[i][j] * (z[j] - target[j]) \
+                                         for j in xrange(i + 1, self.b))
+                rem = bound() - partial
+                if rem < 0:
+                    return
+                width = math.sqrt(rem / diag[i])
+                low = int(math.ceil(center - width))
+                high = int(math.floor(center + width))
+                for k in box_checks[i]:
+                    # |rep_k + 2 sum_{j>i} Q_kj z_j + 2 Q_ki z_i| <= -Q_kk
+                    fixed = rep_list[k] + 2 * sum(int_rows[k][j] * z[j] \
+                                                  for j in support[k] if j > i)
+                    step = 2 * int_rows[k][i]
+                    ndiag = ndiags[k]
+                    if step > 0:
+                        low = max(low, -((ndiag + fixed) // step))
+                        high = min(high, (ndiag - fixed) // step)
+                    else:
+                        low = max(low, -((ndiag - fixed) // -step))
+                        high = min(high, (ndiag + fixed) // -step)
+                # nearest values to the center first, to shrink the search early
+                values = sorted(xrange(low, high + 1), 
+                                key=lambda x: abs(x - center))
+                for value in values:
+                    term = partial + diag[i] * (value - center) ** 2
+                    if term > bound():
+                        break
+                    z[i] = value
+                    if i == 0:
+                        alpha = rep + 2 * columns.dot(z)
+                        magnitude = int(alpha.dot(inverse).dot(alpha))
+                        if magnitude > best[1]:
+                            best[:] = [alpha, magnitude]
+                    else:
+                        search(i - 1, term)
+            
+            search(self.b - 1, 0.0)
+            listofmaxes.append(best[1])
         # get corrterms via (|alpha|^2+b)/4
         print 'Computed from quadratic form in %g seconds' \
               % (time.time() - start_time)
         return [Fraction(Fraction(alpha, self.int_inverse[1]) + self.b, 4) \
-                        for alpha in lst]            
+                for alpha in listofmaxes]
+
+    def reduced_basis(self):
+        '''Returns the unimodular int array whose columns are an LLL reduced
+        basis (lll_reduce) of the lattice ZZ^b with the form -Q.'''
+        return np.array(lll_reduce((-np.asarray(self.mat)).tolist())).T
+
+    def reduced_form(self, basis=None):
+        '''
+        Returns (form, basis): the NDQF 'form' of the same lattice in the 
+        basis 'basis' (None => reduced_basis()), whose smaller diagonal gives
+        a smaller box, and 'basis', so form.mat = basis^T * self.mat * basis.
+
+        alpha -> basis^T alpha takes the characteristic vectors of self to
+        those of form, keeping |alpha|^2 and the classes (alpha + 2Qz goes to
+        basis^T alpha + 2 form.mat basis^(-1) z).
+        '''
+        if basis is None:
+            basis = self.reduced_basis()
+        mat = np.asarray(self.mat)
+        return NDQF(basis.T.dot(mat).dot(basis)), basis
+
+    def reduced_correction_terms(self, multiprocessing=False, engine='auto',
+                                 processes=None):
+        '''
+        Returns the correction terms as correction_term_list, searching the
+        reduced form from reduced_form if its box of characteristic vectors
+        is smaller, and mapping its classes back to the classes of self.
+        Returns None if the box is no smaller.
+        '''
+        basis = self.reduced_basis()
+        # a_i takes -Q(e_i,e_i) + 1 values in the box of characteristic vectors
+        diagonal = (basis * np.asarray(self.mat).dot(basis)).sum(axis=0)
+        box = reduce(lambda x, y: x*y, self.max_bounds(True)[1], 1)
+        reduced_box = reduce(lambda x, y: x*y, (1 - diagonal).tolist(), 1)
+        if reduced_box >= box:
+            return None
+        print 'Searching the reduced form (box %i -> %i)' % (box, reduced_box)
+        form, basis = self.reduced_form(basis)
+        corrterms = form.correction_term_list(multiprocessing, engine,
+                                              processes, reduced=False)
+        return [corrterms[form.class_index(
+                    np.asarray(self.find_rep(coef_list)).ravel().dot(basis))]
+                for coef_list in lrange(self.group.structure)]
+
     def pretty_print(self, lst):
         '''Returns a string, created from lst with Fraction(a,b) written
         a/b'''
@@ -203,16 +743,78 @@ class NDQF(object):
         pretty_string = ', '.join(pretty_list)
         return pretty_string
     
-    def correction_terms(self, multiprocessing=False):
+    def auto_engine(self):
+        '''
+        Returns the engine 'auto' stands for: 'box' when half the box of 
+        characteristic vectors has at most AUTO_BOX_LIMIT alphas (it beats
+        the pruned search's overhead there), else 'pruned' when its rounding
+        error (prune_slack) is at most PRUNE_TOLERANCE, else 'batch'.
+        '''
+        if len(self.get_alpha(characteristic=True, half=True)) <= \
+           AUTO_BOX_LIMIT:
+            return 'box'
+        if self.prune_slack() <= PRUNE_TOLERANCE:
+            return 'pruned'
+        return 'batch'
+
+    def correction_term_list(self, multiprocessing=False, engine='auto',
+                             processes=None, cache=None, reduced=True):
+        '''Finds the correction terms as Fraction objects, in the order of
+        lrange(self.group.structure).
+        
+        engine - 'auto' to choose by the size of the box (auto_engine),
+                 'pruned' to search only the characteristic vectors that can
+                 still improve a maximum (correction_terms_pruned), 'box' to 
+                 iterate through the whole box from max_bounds, 'batch' to
+                 iterate through the box in numpy blocks, 'bounded' to 
+                 iterate through the box in bands until the class maxima
+                 are provably reached (correction_terms_bounded).
+                 multiprocessing always iterates through the box, with
+                 'processes' worker processes (None => cpu_count()).
+        cache - CorrTermCache (term_cache.py) to look the terms up in before
+                computing them, and to store them in after.
+        reduced - search an LLL reduced form instead when its box is smaller
+                  (reduced_correction_terms); the terms are the same.'''
+        if cache is not None:
+            corrterms = cache.get(self)
+            if corrterms is not None:
+                print 'Found correction terms in cache'
+                return corrterms
+        corrterms = None
+        if reduced:
+            corrterms = self.reduced_correction_terms(multiprocessing, engine,
+                                                      processes)
+        if corrterms is None and engine == 'auto':
+            engine = self.auto_engine()
+        if corrterms is not None:
+            pass # found from the reduced form
+        elif multiprocessing:
+            corrterms = self.correction_terms_threaded(processes)
+        elif engine == 'pruned':
+            corrterms = self.correction_terms_pruned()
+        elif engine == 'box':
+            corrterms = self.correction_terms_ugly()
+        elif engine == 'batch':
+            corrterms = self.correction_terms_batch()
+        elif engine == 'bounded':
+            corrterms = self.correction_terms_bounded()
+        else:
+            raise ValueError('Unknown engine %r' % engine)
+        if cache is not None:
+            cache.put(self, corrterms)
+        return corrterms
+
+    def correction_terms(self, multiprocessing=False, engine='auto', 
+                         processes=None, cache=None):
         '''Finds the correction terms and returns them as strings instead of
-        Fraction objects.'''
+        Fraction objects. See correction_term_list for the arguments.'''
         print 'H_1(Y) ~ %s' % self.group.struct()
-        if multiprocessing:
-            corrterms = self.correction_terms_threaded()
-        else:
-            corrterms = self.correction_terms_ugly()
+        corrterms = self.correction_term_list(multiprocessing, engine, 
+                                              processes, cache)
         corrterms = self.pretty_print(corrterms)
         print corrterms
+        print 'Self-conjugate (positions in the list): %s' \
+              % ', '.join(str(index) for index in self.self_conjugate())
         return corrterms
     
     #@profile
@@ -239,6 +841,7 @@ class NDQF(object):
     def equiv_class(self, mat, representatives):
         '''
         Returns the index of 'mat's equivalence class in list 'representatives'.
+        Scans every representative; see class_index for the direct lookup.
         '''
         index = 0
         for rep in representatives:
@@ -247,53 +850,146 @@ class NDQF(object):
             index += 1
         return index
     
-    def max_bounds(self):
+    def max_bounds(self, characteristic=False):
         '''
         Return list of all possible values in 2q(V) (note must be even) s.t. 
         alpha := rep + val satisfies |a_i| <= -Q(e_i, e_i)
+        
+        characteristic - only the values with a_i = Q(e_i, e_i) (mod 2), 
+                         i.e. every other value starting from Q(e_i, e_i)
         '''
         # max_list - list [lst_1, lst_2, ... lst_b] where lst_i is a list of 
         #            possible values for a_i
         # max_list_sizes - list of the size of each list_i in max_list
-        max_list = [range(-ndiag, ndiag+1) for ndiag in self.diagonal]
-        max_list_sizes = [2*ndiag + 1 for ndiag in self.diagonal]
+        step = 2 if characteristic else 1
+        max_list = [range(-ndiag, ndiag+1, step) for ndiag in self.diagonal]
+        max_list_sizes = [len(values) for values in max_list]
         return max_list, max_list_sizes
     
-    def increment(self, counter, pos, diag):
+    def get_alpha(self, start=0, stop=None, characteristic=False, half=False):
+        '''
+        Returns an AlphaRange of all possible values for alpha = [a_1,...,a_b]
+        that satisfy |a_i|<=-Q(e_i,e_i), with a_1 changing fastest. Only the
+        alphas number start to stop (None => the end) are generated.
+        Iterating yields the same list each time, changed in place.
+        
+        characteristic - only the characteristic vectors, 
+                         a_i = Q(e_i,e_i) (mod 2); 2^b times fewer alphas
+        half - only the first half (rounded up) of the alphas: alpha number
+               n is -(alpha number total - 1 - n), so the negatives of these
+               are the rest of the box
+        '''
+        max_list, max_list_sizes = self.max_bounds(characteristic)
+        step = 2 if characteristic else 1
+        if half:
+            total = reduce(lambda x, y: x*y, max_list_sizes, 1)
+            if stop is None or stop > (total + 1) // 2:
+                stop = (total + 1) // 2
+        return AlphaRange([values[0] for values in max_list], max_list_sizes,
+                          [step for values in max_list], start, stop)
+
+    def get_alpha_blocks(self, block_size=BLOCK_SIZE, start=0, stop=None,
+                         characteristic=False):
         '''
-        Increment list 'counter' in position 'pos' from the end.
-        Modifies 'counter'. List 'diag' is the negative of the diagonal elements
-        of Q; i.e. the 2nd output 'max_list_sizes' from max_bounds.
+        Generates the same values as get_alpha, in the same order, as 2-D
+        int64 arrays with (at most) block_size rows. Only the alphas number
+        start to stop (None => the end) are generated.
+        '''
+        return self.get_alpha(start, stop, characteristic).blocks(block_size)
+
+    def get_alpha_band(self, low, high):
+        '''
+        Returns a 2-D int64 array of the characteristic vectors alpha of the
+        box from max_bounds with low < sum a_i^2 <= high, one per row.
+        '''
+        values = [sorted(lst, key=abs) for lst in 
+                  self.max_bounds(characteristic=True)[0]]
+        # largest and smallest sums of a_j^2 over the coordinates j >= i
+        most = [0 for i in xrange(self.b + 1)]
+        least = [0 for i in xrange(self.b + 1)]
+        for i in xrange(self.b - 1, -1, -1):
+            most[i] = most[i + 1] + self.diagonal[i] ** 2
+            least[i] = least[i + 1] + self.diagonal[i] % 2
+        rows = []
+        alpha = [0 for i in xrange(self.b)]
+        
+        def fill(i, norm):
+            if i == self.b:
+                rows.append(alpha[:])
+                return
+            for value in values[i]:
+                partial = norm + value * value
+                if partial + least[i + 1] > high:
+                    break # values are sorted by |a_i|
+                if partial + most[i + 1] > low:
+                    alpha[i] = value
+                    fill(i + 1, partial)
+        
+        fill(0, 0)
+        return np.array(rows, dtype=np.int64).reshape(len(rows), self.b)
+
+class AlphaRange(object):
+    '''
+    The vectors [lows[0] + k_0 steps[0], lows[1] + k_1 steps[1], ...] for
+    0 <= k_i < sizes[i], numbered as a mixed radix number read with k_0 
+    changing fastest. Only the vectors number start to stop (None => the 
+    end) are in the range, so a range can be split into shards.
+    
+    Iterating steps one list in place, carrying into the next coordinate 
+    when a coordinate wraps around, and yields that same list every time; 
+    copy it to keep it. With steps of 2, only vectors of the parity of lows
+    are generated. blocks() generates the same vectors as numpy arrays.
+    '''
+    def __init__(self, lows, sizes, steps=None, start=0, stop=None):
+        self.lows = [int(n) for n in lows]
+        self.sizes = [int(n) for n in sizes]
+        if steps is None:
+            steps = [1 for n in self.lows]
+        self.steps = [int(n) for n in steps]
+        self.highs = [low + (size - 1) * step for low, size, step in 
+                      zip(self.lows, self.sizes, self.steps)]
+        self.total = reduce(lambda x, y: x*y, self.sizes, 1)
+        if stop is None or stop > self.total:
+            stop = self.total
+        self.start = start
+        self.stop = max(start, stop)
+        
+    def __len__(self):
+        return self.stop - self.start
         
-        Basically views counter as the coefficients in a weird base expansion.
-        Also base expansion is 'read' left to right.
-        When one digit reaches the max allowed value (base), it carries over
-        to the digit to the right, and itself is set back to zero.
-        '''
-        if pos >= len(counter): # trying to increment when already at end
-            raise ValueError('Cannot increment counter any further; at end')        
-        if counter[pos] >= diag[pos]-1: # max allowed value at pos
-            counter[pos] = 0 # reset to 0
-            self.increment(counter, pos+1, diag)
-        else: # not at max allowed value
-            counter[pos] += 1
-        return counter
+    def vector(self, number):
+        '''Returns the vector number 'number' (list).'''
+        vector = []
+        for low, size, step in zip(self.lows, self.sizes, self.steps):
+            number, digit = divmod(number, size)
+            vector.append(low + digit * step)
+        return vector
     
-    def get_alpha(self):
-        '''
-        Generates all possible values for alpha = [a_1,...,a_b] that satisfy
-        |a_i|<=-Q(e_i,e_i)
-        '''
-        max_list, max_list_sizes = self.max_bounds()
-        max_list_sizes2 = [val-1 for val in max_list_sizes]
-        counter = [0 for i in xrange(self.b)] # which alpha coords to pick        
-        for i in xrange(reduce(lambda x, y: x*y, max_list_sizes)):
-            #alpha = [-self.diagonal[i] + counter[i] for i in xrange(self.b)]
-            alpha = [max_list[i][counter[i]] for i in xrange(self.b)]
-            yield alpha
-            # update counter
-            if counter != max_list_sizes2:
-                self.increment(counter, 0, max_list_sizes)
+    def __iter__(self):
+        if self.start >= self.stop:
+            return
+        vector = self.vector(self.start)
+        lows, highs, steps = self.lows, self.highs, self.steps
+        for number in xrange(self.stop - self.start - 1):
+            yield vector
+            i = 0
+            while vector[i] == highs[i]: # carry
+                vector[i] = lows[i]
+                i += 1
+            vector[i] += steps[i]
+        yield vector
+    
+    def blocks(self, block_size=BLOCK_SIZE):
+        '''Generates the vectors of the range as 2-D int64 arrays with (at
+        most) block_size rows.'''
+        lows = np.array(self.lows, dtype=np.int64)
+        sizes = np.array(self.sizes, dtype=np.int64)
+        steps = np.array(self.steps, dtype=np.int64)
+        places = np.cumprod(np.concatenate(([1], sizes[:-1])))
+        for first in xrange(self.start, self.stop, block_size):
+            indices = np.arange(first, min(first + block_size, self.stop), 
+                                dtype=np.int64)
+            yield lows + (indices[:, np.newaxis] // places) % sizes * steps
 
 class Hom_Group(object):
     '''A homology group.'''
@@ -316,21 +1012,7 @@ class Hom_Group(object):
     
     def struct(self):
         '''Return structure of H_1(Y) as string'''
-        def rep(i):
-            '''The string representation of Z/i'''
-            i = i if i > 0 else -i
-            if i == 0:
-                return "Z"
-            elif i == 1:
-                return "1"
-            else:
-                return "Z/" + str(i) + "Z"
-        reps = map(rep, self.structure)
-        if reps:
-            structure = reduce(lambda s, z: s + 'x' + z, reps)
-        else:
-            structure = "1"
-        return structure
+        return homology_struct(self.structure)
 
     def __repr__(self):
         ''' Shows the structure of the group, as well as generators and
@@ -357,6 +1039,21 @@ class Hom_Group(object):
             ret.append("     (No relations, free)")
         return '\n'.join(ret)
 
+def homology_struct(structure):
+    '''Returns the string for the group ZZ/n1 x ZZ/n2 x ... with 
+    'structure' [n1, n2, ...] (invariant factors; 1s are left out).'''
+    def rep(i):
+        '''The string representation of Z/i'''
+        i = i if i > 0 else -i
+        if i == 0:
+            return "Z"
+        else:
+            return "Z/" + str(i) + "Z"
+    reps = [rep(i) for i in structure if i not in (1, -1)]
+    if reps:
+        return 'x'.join(reps)
+    return "1"
+
 def lrange(index_list):
     '''Returns a generators that iterates over range(ind1) x range(ind2) ...'''
     if not index_list:
@@ -367,6 +1064,78 @@ def lrange(index_list):
             for l_sub in lrange(index_list[1:]):
                 yield [i_sub] + l_sub
 
+def lll_reduce(gram):
+    '''
+    Returns the unimodular matrix H (list of rows) whose rows are an LLL
+    reduced basis (delta = 3/4) of the lattice with positive definite Gram 
+    matrix 'gram' (integer list of rows), in terms of the given basis. The
+    reduced Gram matrix is H * gram * H^T.
+    
+    Integral LLL on the Gram matrix (Cohen, A Course in Computational
+    Algebraic Number Theory, Algorithm 2.6.7): lam[k][j] = d_(j+1) mu_kj and 
+    d[j] is the Gram determinant of the first j vectors, so every division
+    is exact.
+    '''
+    size = len(gram)
+    gram = [[int(n) for n in row] for row in gram]
+    basis = [[int(i == j) for j in xrange(size)] for i in xrange(size)]
+    lam = [[0 for j in xrange(size)] for i in xrange(size)]
+    d = [1 for i in xrange(size + 1)] # d[0] = 1; d[j + 1] for vector j
+    
+    def subtract(k, l, q):
+        # vector k -> vector k - q vector l
+        basis[k] = [x - q * y for x, y in zip(basis[k], basis[l])]
+        gram[k] = [x - q * y for x, y in zip(gram[k], gram[l])]
+        for row in gram:
+            row[k] -= q * row[l]
+    
+    def red(k, l):
+        if 2 * abs(lam[k][l]) > d[l + 1]:
+            q = (2 * lam[k][l] + d[l + 1]) // (2 * d[l + 1]) # nearest int
+            subtract(k, l, q)
+            lam[k][l] -= q * d[l + 1]
+            for i in xrange(l):
+                lam[k][i] -= q * lam[l][i]
+    
+    def swap(k, kmax):
+        basis[k], basis[k - 1] = basis[k - 1], basis[k]
+        gram[k], gram[k - 1] = gram[k - 1], gram[k]
+        for row in gram:
+            row[k], row[k - 1] = row[k - 1], row[k]
+        for j in xrange(k - 1):
+            lam[k][j], lam[k - 1][j] = lam[k - 1][j], lam[k][j]
+        mu = lam[k][k - 1]
+        new = (d[k - 1] * d[k + 1] + mu * mu) // d[k]
+        for i in xrange(k + 1, kmax + 1):
+            t = lam[i][k]
+            lam[i][k] = (d[k + 1] * lam[i][k - 1] - mu * t) // d[k]
+            lam[i][k - 1] = (new * t + mu * lam[i][k]) // d[k + 1]
+        d[k] = new
+    
+    if size:
+        d[1] = gram[0][0]
+    k, kmax = 1, 0
+    while k < size:
+        if k > kmax: # incremental Gram-Schmidt
+            kmax = k
+            for j in xrange(k + 1):
+                u = gram[k][j]
+                for i in xrange(j):
+                    u = (d[i + 1] * u - lam[k][i] * lam[j][i]) // d[i]
+                if j < k:
+                    lam[k][j] = u
+                else:
+                    d[k + 1] = u
+        red(k, k - 1)
+        if 4 * d[k + 1] * d[k - 1] < 3 * d[k] ** 2 - 4 * lam[k][k - 1] ** 2:
+            swap(k, kmax)
+            k = max(1, k - 1)
+        else:
+            for l in xrange(k - 2, -1, -1):
+                red(k, l)
+            k += 1
+    return basis
+
 def nlrange(index_list):
     '''Returns a generator that is essentially range(-ind1+1, ind1) x ... 
     to traverse over a lattice.'''
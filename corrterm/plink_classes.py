@@ -12,7 +12,7 @@ VertexClass, EdgeClass, IntersectionClass, and RegionClass objects are stored
 in global variables gVertex, gEdge, gIntersection, and gRegion, respectively.
 '''
 
-import math, sys, plink
+import math, sys
 from fractions import Fraction
 
 class VertexClass():
@@ -14,7 +14,7 @@ If no filename is specified, Plink editor will open.
 '''
 
 from plink_classes import *
-import StringIO
+import StringIO, plink
 import Tkinter, tkFileDialog, tkMessageBox
 import numpy
 
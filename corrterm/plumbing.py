@@ -0,0 +1,248 @@
+# FILE: plumbing.py
+
+'''
+Correction terms of plumbed 3-manifolds, computed from the weighted forest
+(weighted_graph.py) instead of searching the lattice of the quadratic form.
+
+Removing the bad vertices (-weight < degree) leaves trees of good vertices.
+On each tree, -Q is diagonally dominant with nonpositive entries off the
+diagonal, so it is minimized exactly as a branch of a star-shaped tree
+(seifert.Branch). Only the coordinates of the (at most 2) bad vertices are
+searched.
+'''
+
+import numpy, time
+from fractions import Fraction
+from ndqf import NDQF, lrange
+from seifert import Branch
+from sparse_form import SparseForm
+
+class Plumbing(object):
+    '''
+    The plumbing forest of a networkx graph (nodes with an int attribute
+    'weight', as in weighted_graph.py), with the vertices ordered as in
+    'node_list'.
+
+    minimum(alpha) is the minimum over integer vectors x of
+        x(-Q)x - alpha.x
+    For the coordinates z of the bad vertices fixed, the trees of good
+    vertices are independent: on the tree T it is the minimum of
+    yA_Ty - c_T.y, where c_T is alpha on T plus 2z_j at the neighbours of each
+    bad vertex j.
+    '''
+    def __init__(self, graph, node_list):
+        index = dict((node, k) for k, node in enumerate(node_list))
+        self.size = len(node_list)
+        self.weights = [graph.node[node]['weight'] for node in node_list]
+        self.neighbours = [sorted(index[other] for other in
+                                  graph.neighbors(node)) for node in node_list]
+        self.bad = [k for k in xrange(self.size)
+                    if self.weights[k] > -len(self.neighbours[k])]
+        bad_position = dict((k, j) for j, k in enumerate(self.bad))
+        # trees of good vertices: (vertices, Branch, links), where links
+        # lists (position in tree, position in self.bad) for each edge to a
+        # bad vertex
+        self.trees = []
+        seen = set(self.bad)
+        for root in xrange(self.size):
+            if root in seen:
+                continue
+            seen.add(root)
+            vertices, parents = [root], [-1]
+            position = 0
+            while position < len(vertices): # breadth first
+                for other in self.neighbours[vertices[position]]:
+                    if other not in seen:
+                        seen.add(other)
+                        vertices.append(other)
+                        parents.append(position)
+                position += 1
+            branch = Branch([-self.weights[k] for k in vertices], parents)
+            links = [(position, bad_position[other]) for position, vertex in
+                     enumerate(vertices) for other in self.neighbours[vertex]
+                     if other in bad_position]
+            self.trees.append((vertices, branch, links))
+        # -Q on the bad vertices
+        self.bad_matrix = [[-self.weights[k] if k == l else
+                            -int(l in self.neighbours[k]) for l in self.bad]
+                           for k in self.bad]
+        # over real y, the trees add -c_T A_T^(-1) c_T / 4, so the minimum for
+        # z fixed is at least zSz + (linear in z) with the Schur complement
+        # S = -Q_BB - E^T A^(-1) E of the good vertices (E = Q_GB); exact, 
+        # as there are at most 2 bad vertices
+        schur = [[Fraction(n) for n in row] for row in self.bad_matrix]
+        for vertices, branch, links in self.trees:
+            for position, j in links:
+                for other, l in links:
+                    schur[j][l] -= Fraction(branch.inverse[position][other],
+                                            branch.denom)
+        # zSz = sum_i diag[i] * (z_i + sum_(j>i) coefs[i][j] * z_j)^2
+        size = len(self.bad)
+        self.diag = []
+        self.coefs = []
+        for i in xrange(size):
+            self.diag.append(schur[i][i])
+            self.coefs.append([schur[i][j] / schur[i][i] for j in xrange(size)])
+            for j in xrange(i + 1, size):
+                for l in xrange(i + 1, size):
+                    schur[j][l] -= self.diag[i] * self.coefs[i][j] * \
+                                   self.coefs[i][l]
+
+    def quad(self, sparse=False):
+        '''Returns the quadratic form (numpy array, or SparseForm if sparse),
+        as weighted_graph.g_quad.'''
+        quad = SparseForm(self.weights, [(k, other, 1) for k in 
+                                         xrange(self.size) for other in 
+                                         self.neighbours[k] if k < other])
+        if sparse:
+            return quad
+        return quad.dense()
+
+    def value(self, alpha, z, pieces=None):
+        '''
+        Returns the minimum of x(-Q)x - alpha.x over integer vectors x with
+        the coordinates z on the bad vertices (int).
+        
+        pieces - for each tree T, (c_T, A_T^(-1) c_T * denom) for z = 0, if 
+                 already known; A_T^(-1) c_T only changes by a column of 
+                 A_T^(-1) for each link to a bad vertex
+        '''
+        total = sum(z[j] * sum(m * n for m, n in zip(row, z)) -
+                    alpha[k] * z[j] for j, (k, row) in
+                    enumerate(zip(self.bad, self.bad_matrix)))
+        if pieces is None:
+            pieces = self.pieces(alpha)
+        for (vertices, branch, links), (c, solution) in zip(self.trees, 
+                                                            pieces):
+            for position, j in links:
+                if z[j]:
+                    c = c[:]
+                    c[position] += 2 * z[j]
+                    solution = [n + 2 * z[j] * m for n, m in 
+                                zip(solution, branch.inverse[position])]
+            total += branch.minimum(c, solution)
+        return total
+
+    def pieces(self, alpha):
+        '''Returns the list of (c_T, A_T^(-1) c_T * denom) for z = 0 over the
+        trees T, as used by value.'''
+        pieces = []
+        for vertices, branch, links in self.trees:
+            c = [alpha[k] for k in vertices]
+            pieces.append((c, branch.times(branch.inverse, c)))
+        return pieces
+
+    def minimum(self, alpha):
+        '''
+        Returns the minimum of x(-Q)x - alpha.x over integer vectors x (int).
+
+        Writing the lower bound for z fixed as its minimum plus
+        sum_i d_i (w_i + sum_(j>i) u_ij w_j)^2, w = z - (real minimum), the
+        bad coordinates are searched last to first, nearest values first,
+        until the bound cannot beat the best value found (as in
+        NDQF.correction_terms_pruned). The bound is computed in Fractions,
+        so the pruning is exact: values are ints, so a bound above the best
+        value minus 1 cannot be beaten.
+        '''
+        size = len(self.bad)
+        diag, coefs = self.diag, self.coefs
+        # constant and linear coefficients of the lower bound
+        constant = Fraction(0)
+        linear = [Fraction(-alpha[k]) for k in self.bad]
+        pieces = self.pieces(alpha)
+        for (vertices, branch, links), (c, solution) in zip(self.trees, 
+                                                            pieces):
+            constant -= Fraction(sum(m * n for m, n in zip(c, solution)),
+                                 4 * branch.denom)
+            for position, j in links:
+                linear[j] -= Fraction(solution[position], branch.denom)
+        # real minimum: solve 2Sz = -linear with the decomposition of S
+        for i in xrange(size):
+            for j in xrange(i + 1, size):
+                linear[j] -= coefs[i][j] * linear[i]
+        center = [Fraction(0) for i in xrange(size)]
+        for i in xrange(size - 1, -1, -1):
+            center[i] = -linear[i] / (2 * diag[i]) - \
+                sum(coefs[i][j] * center[j] for j in xrange(i + 1, size))
+        # the bound at the real minimum
+        lowest = constant - sum(diag[i] * (linear[i] / (2 * diag[i])) ** 2
+                                for i in xrange(size))
+        z = [int(round(n)) for n in center]
+        best = [self.value(alpha, z, pieces)]
+
+        def search(i, partial):
+            if i < 0:
+                best[0] = min(best[0], self.value(alpha, z, pieces))
+                return
+            middle = center[i] - sum(coefs[i][j] * (z[j] - center[j])
+                                     for j in xrange(i + 1, size))
+            for value in outward(middle):
+                term = partial + diag[i] * (value - middle) ** 2
+                if lowest + term > best[0] - 1: # no int value below best
+                    break
+                z[i] = value
+                search(i - 1, term)
+
+        if size:
+            search(size - 1, Fraction(0))
+        return best[0]
+
+def outward(center):
+    '''Generates the integers in order of distance from 'center'.'''
+    low = int(center // 1) # exact for Fractions
+    high = low + 1
+    while True:
+        if center - low <= high - center:
+            yield low
+            low -= 1
+        else:
+            yield high
+            high += 1
+
+def p_corr_terms(graph, node_list, quadform=None, cache=None, check=False,
+                 multiprocessing=False):
+    '''
+    Returns the correction terms (list of Fractions) of the plumbing forest
+    'graph' with the vertices ordered as in 'node_list', in the order of
+    lrange(quadform.group.structure), where quadform is the NDQF of its
+    quadratic form (weighted_graph.g_quad; made here if not given).
+
+    For each Spin^c class with characteristic vector alpha, the maximum of
+    |alpha + 2Qx|^2 = |alpha|^2 + 4(alpha.x + xQx) is found by
+    Plumbing.minimum, searching only the coordinates of the bad vertices.
+
+    cache - CorrTermCache (term_cache.py), as in NDQF.correction_term_list
+    check - also compute the correction terms with the quadratic form
+            search of NDQF, and raise RuntimeError if they differ
+    multiprocessing - use multiprocessing for the search of 'check'
+    '''
+    plumbing = Plumbing(graph, node_list)
+    if quadform is None:
+        quadform = NDQF(plumbing.quad())
+    if cache is not None:
+        corrterms = cache.get(quadform)
+        if corrterms is not None and not check:
+            print 'Found correction terms in cache'
+            return corrterms
+    start_time = time.time()
+    denom = quadform.int_inverse[1]
+    corrterms = []
+    for index, coef_list in enumerate(lrange(quadform.group.structure)):
+        conjugate = quadform.conjugate_index(index)
+        if conjugate < index: # same as conjugate class
+            corrterms.append(corrterms[conjugate])
+            continue
+        alpha = numpy.asarray(quadform.find_rep(coef_list)).ravel().tolist()
+        magnitude = quadform.find_abs(alpha) - \
+            4 * denom * plumbing.minimum(alpha)
+        corrterms.append(Fraction(Fraction(magnitude, denom) +
+                                  quadform.b, 4))
+    print 'Computed from the plumbing graph in %g seconds' \
+          % (time.time() - start_time)
+    if check:
+        if corrterms != quadform.correction_term_list(multiprocessing):
+            raise RuntimeError('Plumbing and quadratic form correction terms '
+                               'differ')
+    if cache is not None:
+        cache.put(quadform, corrterms)
+    return corrterms
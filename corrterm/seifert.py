@@ -2,13 +2,14 @@
 # FILE: seifert.py
 # 01.08.14
 
-import numpy, sys
+import numpy, sys, time
 from fractions import Fraction, gcd
-from graph_quad import symmetric, is_negative_definite
-import tkMessageBox
-import networkx as nx
-import matplotlib.pyplot as plt
-from weighted_graph import g_quad
+from graph_quad import is_negative_definite
+from sparse_form import SparseForm
+from ndqf import NDQF, lrange, homology_struct
+from smith import invariant_factors
+# tkMessageBox, networkx and matplotlib are imported only where they are used,
+# so that the quadratic form can be computed without a GUI (corrterms.py)
 
 
 def correct_form(listdata, gui=False):
@@ -33,6 +34,7 @@ def correct_form(listdata, gui=False):
                 suffix = 'th'  
                 
             if gui:
+                import tkMessageBox
                 tkMessageBox.showwarning('Warning',\
                                     'Warning: q%i=0, ignoring the %i%s pair'\
                                     %(index+1, index+1, suffix))                
@@ -106,6 +108,7 @@ def alter_data(listdata, gui=True):
     minus = False
     if invariants(listdata)[1] == 0:
         if gui:
+            import tkMessageBox
             tkMessageBox.showerror('Bad data', 'Bad data: e + sum(qi/pi) = 0.')
         raise ValueError('bad data: e + sum(qi/pi) = 0')
     if invariants(listdata)[1] < 0: # need to reverse orientation
@@ -183,11 +186,12 @@ def cont_fraction(p, q):
         divisor = divisor - remainder
     return cont_frac
 
-def s_quad_form(listdata, gui=True):
+def s_quad_form(listdata, gui=True, sparse=False):
     '''
     Returns the tuple (numpy.array quadratic_form, bool minus) of the weighted 
     'star-like' tree associated with the plumbed 3-manifold given by Seifert 
-    data 'listdata'.
+    data 'listdata'. With sparse=True, quadratic_form is a SparseForm 
+    (sparse_form.py) instead, which is never densified here.
     
     minus = True if orientation of the manifold described by listdata has been
     reversed, False otherwise
@@ -216,32 +220,27 @@ def s_quad_form(listdata, gui=True):
         branch = cont_fraction(pair[0], -pair[1])
         branch_lengths.append(len(branch))
         tree.extend(branch)
-    size = sum(branch_lengths) + 1 # add start node
-    row = 0
-    column = 0
-    # make the quadratic form matrix
-    quad = numpy.zeros(shape=(size, size), dtype=numpy.int)
-    # fill in the diagonal
-    for index in range(size):
-        quad[index,index] = -tree[index]
-    # fill in the others (upper right triangle)
+    # the edges of the tree
+    edges = []
     cur_position = 1
     for length in branch_lengths:
-        quad[0,cur_position] = 1 # star node
+        edges.append((0, cur_position, 1)) # star node
         for index in range(cur_position, cur_position+length-1):
-            quad[index,index+1] = 1 # adjacent
+            edges.append((index, index+1, 1)) # adjacent
         cur_position += length
-    symmetric(quad)
+    quad = SparseForm([-weight for weight in tree], edges)
     if not is_negative_definite(quad):
         if gui:
+            import tkMessageBox
             tkMessageBox.showwarning('Quadratic form', 
                                      'Quadratic form is not negative definite')
-        print quad
+        print quad.dense()
         raise ValueError('quadratric form is not negative definite')        
-    # check get the same thing from weighted_graph.py; also checks negative def.
-    assert numpy.array_equal(quad, g_quad(make_graph(new_data), \
-                                          ['N%i' %num for num in range(size)]))
-    return quad, minus
+    # test_g_quad in test_weighted_graph.py checks we get the same thing from
+    # weighted_graph.py
+    if sparse:
+        return quad, minus
+    return quad.dense(), minus
 
 def make_graph(listdata):
     '''
@@ -249,6 +248,7 @@ def make_graph(listdata):
     
     Weighted graph is after altering listdata.
     '''
+    import networkx as nx
     data = alter_data(listdata)[0]
     startree = nx.Graph()
     startree.add_node('N0', weight=-data[0]) # add root node, weight -e
@@ -266,6 +266,8 @@ def make_graph(listdata):
     
 def s_draw(listdata):
     '''Draw the weighted graph associated with the Seifert data 'listdata'.'''
+    import networkx as nx
+    import matplotlib.pyplot as plt
     startree = make_graph(listdata)
     labels = dict((n, '%s,%s' %(n,a['weight'])) for n,a in 
                   startree.nodes(data=True))
@@ -273,6 +275,220 @@ def s_draw(listdata):
                      alpha=0.7)    
     plt.show()    
                
+class Branch(object):
+    '''
+    A branch of the star-shaped tree: a chain of vertices with weights 
+    -a_1, ..., -a_n (a_k >= 2), where the first vertex is connected to the
+    center node. More generally, a tree of vertices with weights -a_k, with
+    a_k at least the degree of vertex k (plumbing.py).
+    
+    A is -Q restricted to the branch: a_k down the diagonal, -1 for adjacent
+    vertices. For an integer vector c, minimum(c) is the minimum over integer
+    vectors y of
+        h_c(y) = yAy - c.y
+    A has nonpositive entries off the diagonal and is diagonally dominant 
+    (a_k >= 2), so h_c is L-natural convex: y is a minimum as soon as 
+    h_c(y +- 1_S) >= h_c(y) for every set S of vertices (1_S is 1 on S, 0 
+    elsewhere), and steepest descent along these steps finds a minimum.
+    '''
+    def __init__(self, weights, parents=None):
+        '''weights - [a_1, ..., a_n], as returned by cont_fraction
+        parents - index of the vertex adjacent to vertex k towards the first
+                  vertex, for k > 0 (smaller than k); None => a chain'''
+        self.size = len(weights)
+        if parents is None:
+            parents = range(-1, self.size - 1)
+        self.parents = parents
+        self.weights = list(weights)
+        self.neighbours = [[] for k in xrange(self.size)]
+        self.matrix = [[0 for l in xrange(self.size)] 
+                       for k in xrange(self.size)]
+        for k, weight in enumerate(weights):
+            self.matrix[k][k] = weight
+            if k > 0:
+                self.matrix[k][parents[k]] = self.matrix[parents[k]][k] = -1
+                self.neighbours[k].append(parents[k])
+                self.neighbours[parents[k]].append(k)
+        inverse, denom = NDQF.exact_inverse(numpy.array(self.matrix))
+        # A^(-1) = self.inverse / self.denom
+        self.inverse = [[int(n) for n in row] for row in inverse.tolist()]
+        self.denom = int(denom)
+        self.minima = {} # minimum of h_c, for reduced c (see minimum)
+        
+    def times(self, mat, vect):
+        return [sum(m * v for m, v in zip(row, vect)) for row in mat]
+    
+    def apply(self, vect):
+        '''Returns A * vect, using that A is sparse.'''
+        return [a * v - sum(vect[l] for l in neighbours) for a, v, neighbours
+                in zip(self.weights, vect, self.neighbours)]
+    
+    def minimum(self, c, solution=None):
+        '''
+        Returns the minimum of h_c over integer vectors (int).
+        
+        h_c(y + z) = h_(c - 2Az)(y) + zAz - c.z, and z = floor(A^(-1)c/2) 
+        leaves A^(-1)(c - 2Az)/2 in [0, 1)^n, so c - 2Az only depends on 
+        A^(-1)c modulo 2. Each reduced c is minimized once.
+        
+        solution - self.inverse * c, if already known
+        '''
+        twice = 2 * self.denom
+        if solution is None:
+            solution = self.times(self.inverse, c)
+        shift = [n // twice for n in solution]
+        key = tuple(n % twice for n in solution)
+        image = self.apply(shift)
+        if key not in self.minima:
+            self.minima[key] = self.descend([m - 2 * n for m, n in 
+                                             zip(c, image)])
+        return self.minima[key] + sum(m * (n - l) for m, n, l in 
+                                      zip(shift, image, c))
+
+    def descend(self, c):
+        '''Returns the minimum of h_c, by steepest descent from y = 0.'''
+        y = [0 for k in xrange(self.size)]
+        value = 0
+        while True:
+            image = self.apply(y)
+            # h_c(y + sign 1_S) - h_c(y) is the sum of 
+            # a_k + sign(2(Ay)_k - c_k) over k in S, -2 for adjacent k in S
+            steps = [self.best_step([self.matrix[k][k] + 
+                                     sign * (2 * image[k] - c[k]) 
+                                     for k in xrange(self.size)]) + (sign,)
+                     for sign in (1, -1)]
+            change, subset, sign = min(steps)
+            if change >= 0:
+                return value
+            for k in subset:
+                y[k] += sign
+            value += change
+    
+    def best_step(self, gains):
+        '''
+        Returns (change, S) minimizing change = sum of gains[k] over k in S, 
+        -2 for each pair of adjacent vertices in S, over all sets S of 
+        vertices of the tree (S is a list).
+        '''
+        # best (change, S) over the vertices below k, with k not in S / in S
+        without = [(0, []) for k in xrange(self.size)]
+        within = [(gain, [k]) for k, gain in enumerate(gains)]
+        for k in xrange(self.size - 1, 0, -1):
+            parent = self.parents[k]
+            below = min(without[k], within[k])
+            without[parent] = (without[parent][0] + below[0], 
+                               without[parent][1] + below[1])
+            below = min(without[k], (within[k][0] - 2, within[k][1]))
+            within[parent] = (within[parent][0] + below[0], 
+                              within[parent][1] + below[1])
+        return min(without[0], within[0])
+
+def star_minimum(e, branches, alpha):
+    '''
+    Returns the minimum over integer vectors x of x(-Q)x - alpha.x (int), 
+    where Q is the quadratic form of the star-shaped tree with center weight
+    -e and the Branch objects 'branches', in the order of s_quad_form.
+    
+    For the center coefficient x_0 = i fixed, the branches are independent:
+    the branch with alpha entries c has minimum branch.minimum(c + 2i e_1),
+    e_1 = (1, 0, ..., 0). Over real vectors this is at least a convex 
+    quadratic in i, so i goes out from the real minimum in both directions
+    until that bound cannot beat the best minimum found.
+    '''
+    pieces = [] # alpha entries of each branch
+    position = 1
+    for branch in branches:
+        pieces.append(alpha[position:position + branch.size])
+        position += branch.size
+    def shifted(piece, i):
+        return [piece[0] + 2 * i] + piece[1:]
+    def value(i):
+        return e * i * i - alpha[0] * i + \
+            sum(branch.minimum(shifted(piece, i)) for branch, piece in 
+                zip(branches, pieces))
+    # real minimum for x_0 = i, times 4 * common: 
+    # quadratic * i^2 + linear * i + constant
+    common = reduce(lambda m, n: m * n // gcd(m, n), 
+                    [branch.denom for branch in branches], 1)
+    quadratic = 4 * e * common
+    linear = -4 * alpha[0] * common
+    constant = 0
+    for branch, piece in zip(branches, pieces):
+        scale = common // branch.denom
+        solution = branch.times(branch.inverse, piece)
+        quadratic -= 4 * scale * branch.inverse[0][0]
+        linear -= 4 * scale * solution[0]
+        constant -= scale * sum(m * n for m, n in zip(piece, solution))
+    def bound(i):
+        return quadratic * i * i + linear * i + constant
+    center = -linear // (2 * quadratic)
+    best = value(center)
+    for i, step in ((center - 1, -1), (center + 1, 1)):
+        while bound(i) < 4 * common * best:
+            best = min(best, value(i))
+            i += step
+    return best
+
+def s_corr_terms(listdata, quadform=None, cache=None, check=False, 
+                 multiprocessing=False):
+    '''
+    Returns the correction terms (list of Fractions) of the star-shaped tree
+    of the Seifert data 'listdata', in the order of 
+    lrange(quadform.group.structure), where quadform is the NDQF of 
+    s_quad_form(listdata)[0] (made here if not given). As for 
+    NDQF.correction_term_list, they are not negated if the orientation was
+    reversed.
+    
+    For each Spin^c class with characteristic vector alpha, the maximum of
+    |alpha + 2Qx|^2 = |alpha|^2 + 4(alpha.x + xQx) is found by star_minimum,
+    in time polynomial in the lengths of the continued fractions, instead of 
+    searching the whole lattice.
+    
+    cache - CorrTermCache (term_cache.py), as in NDQF.correction_term_list
+    check - also compute the correction terms with the quadratic form 
+            search of NDQF, and raise RuntimeError if they differ
+    multiprocessing - use multiprocessing for the search of 'check'
+    '''
+    if quadform is None:
+        quadform = NDQF(s_quad_form(listdata, gui=False)[0])
+    if cache is not None:
+        corrterms = cache.get(quadform)
+        if corrterms is not None and not check:
+            print 'Found correction terms in cache'
+            return corrterms
+    start_time = time.time()
+    new_data = alter_data(listdata, gui=False)[0]
+    branches = [Branch(cont_fraction(p, -q)) for p, q in new_data[1:]]
+    denom = quadform.int_inverse[1]
+    corrterms = []
+    for index, coef_list in enumerate(lrange(quadform.group.structure)):
+        conjugate = quadform.conjugate_index(index)
+        if conjugate < index: # same as conjugate class
+            corrterms.append(corrterms[conjugate])
+            continue
+        alpha = quadform.descend(quadform.find_rep(coef_list))
+        alpha = [int(n) for n in alpha]
+        magnitude = quadform.find_abs(alpha) - \
+            4 * denom * star_minimum(new_data[0], branches, alpha)
+        corrterms.append(Fraction(Fraction(magnitude, denom) + 
+                                  quadform.b, 4))
+    print 'Computed from Seifert data in %g seconds' \
+          % (time.time() - start_time)
+    if check:
+        if corrterms != quadform.correction_term_list(multiprocessing):
+            raise RuntimeError('Seifert and quadratic form correction terms '
+                               'differ')
+    if cache is not None:
+        cache.put(quadform, corrterms)
+    return corrterms
+
+def s_homology(listdata):
+    '''Returns H_1(Y) (string, as Hom_Group.struct) of the Seifert data 
+    'listdata' from the invariant factors of its quadratic form only 
+    (smith.invariant_factors), without making the NDQF.'''
+    return homology_struct(invariant_factors(s_quad_form(listdata, gui=False,
+                                                         sparse=True)[0]))
+
 def usage():
     print "usage: python %s '[e,(p1,q1),...(pr,qr)]'" % sys.argv[0]
     sys.exit(1)
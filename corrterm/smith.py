@@ -1,10 +1,11 @@
+import math
 import numpy as np
-import functools
 import itertools
 import fractions as f
 import numpy.linalg as la
 import sys
 from number_theory import *
+from sparse_form import SparseForm
 
 verbose = False
         
@@ -113,13 +114,21 @@ def _smith_normal_form(mat, track_dict):
     solve_diagonal(mat, track_dict)
     return mat
 
-def smith_normal_form(mat):
+def smith_normal_form(mat, engine='iterative'):
     '''Creates a new matrix and sets it equal to the Smith Normal Form of mat:
     Finds a matrix D, such that U * D * v = mat for unimodular U and V, and 
     D is diagonal. The standard form is to have the diagonal entries correspond
     to the invariant factors: d[i] | d[i + 1].
     Use: Computes the invariant factor description from a presentation of a module,
-    ZZ ^ (mat.length) / < mat.columns >'''
+    ZZ ^ (mat.length) / < mat.columns >
+    
+    engine - 'iterative' for the loops over one array (_smith_normal_form_array),
+             'recursive' for the recursion on submatrix views; both make
+             the same operations, so give the same D, U and V.'''
+    if engine == 'iterative':
+        return _smith_normal_form_array(mat)
+    if engine != 'recursive':
+        raise ValueError('Unknown engine %r' % engine)
     x = np.matrix.copy(mat)
     # right_track watches the change of basis via the unimodular matrix to the right.
     # It's rows are the generators of the presented module.
@@ -130,6 +139,261 @@ def smith_normal_form(mat):
     _smith_normal_form(x, tracker)
     return x, (tracker['row_op'], tracker['col_op']) # D, (U, V)
 
+def _smith_normal_form_array(mat):
+    '''
+    Returns (D, (U, V)) as smith_normal_form, making the same row and column
+    operations as _smith_normal_form, but with loops instead of recursion, 
+    in place on one ndarray, and on the tracking matrices directly instead 
+    of through row_promote and col_promote.
+    
+    The array is int64 (object if mat is, for integers of any size). Block
+    k is the view x[k:, k:]: the recursion reduces blocks 0, 1, ... to a 
+    pivot and a zero facade, then solves the diagonal of the nonzero blocks
+    last to first.
+    '''
+    dtype = object if np.asarray(mat).dtype == object else np.int64
+    x = np.array(mat, dtype=dtype)
+    left = np.eye(x.shape[0], dtype=int).astype(dtype)
+    right = np.eye(x.shape[1], dtype=int).astype(dtype)
+    blocks = 0
+    while not np.all(x[blocks:, blocks:] == 0):
+        k = blocks
+        i, j = best_pivot_whole(x[k:, k:])
+        _swap_pivot(x, k, i, j, left, right)
+        _reduce_facade(x, k, left, right)
+        blocks += 1
+    for k in xrange(blocks - 1, -1, -1):
+        # solve_diagonal(x[k:, k:]) returns after solving the blocks after
+        # it, then itself again, until its diagonal chains
+        stack = [k]
+        while stack:
+            top = stack[-1]
+            block = x[top:, top:]
+            if block.size == 0 or is_diagonal(block) and \
+               diagonal_chaining(block):
+                if block.size and block[0, 0] < 0:
+                    block[0, :] *= -1
+                    left[:, top] *= -1
+                stack.pop()
+                continue
+            _divide_block(x, top, left, right)
+            stack.append(top + 1)
+    return np.asmatrix(x), (np.asmatrix(left), np.asmatrix(right))
+
+def _swap_pivot(x, k, i, j, left, right):
+    '''Moves x[k + i, k + j] to x[k, k] (row_swap, col_swap on block k).'''
+    if i:
+        x[[k, k + i]] = x[[k + i, k]]
+        left[:, [k, k + i]] = left[:, [k + i, k]]
+    if j:
+        x[:, [k, k + j]] = x[:, [k + j, k]]
+        right[[k, k + j]] = right[[k + j, k]]
+
+def _reduce_facade(x, k, left, right):
+    '''smith_normal_form_helper on block k of x: the row and column 
+    reductions by the pivot are each one outer product.'''
+    block = x[k:, k:]
+    while not all_zero_facade(block):
+        pivot = block[0, 0]
+        # the quotients come from the facade before either reduction, as 
+        # the row reductions leave the first row alone
+        row_quots = np.array([div_alg(n, pivot)[0] for n in block[1:, 0]],
+                             dtype=x.dtype)
+        col_quots = np.array([div_alg(n, pivot)[0] for n in block[0, 1:]],
+                             dtype=x.dtype)
+        block[1:, :] -= np.outer(row_quots, block[0, :])
+        left[:, k] += left[:, k + 1:].dot(row_quots)
+        block[:, 1:] -= np.outer(block[:, 0], col_quots)
+        right[k, :] += col_quots.dot(right[k + 1:, :])
+        i, j = best_pivot_facade(block)
+        _swap_pivot(x, k, i, j, left, right)
+    if block[0, 0] < 0:
+        block[0, :] *= -1
+        left[:, k] *= -1
+
+def _divide_block(x, k, left, right):
+    '''The loop of solve_diagonal on block k of x: for each entry in turn
+    (row by row) not divisible by the pivot, adds its column to the first
+    and reduces the facade again, changing the pivot.'''
+    block = x[k:, k:]
+    columns = block.shape[1]
+    start = 0
+    while True:
+        pivot = block[0, 0]
+        rest = block.ravel()[start:] # a copy, as block is not contiguous
+        if pivot == 0:
+            found = np.flatnonzero(rest != 0)
+        else:
+            found = np.flatnonzero(rest % pivot != 0)
+        if not len(found):
+            return
+        start += int(found[0])
+        column = start % columns
+        block[:, 0] += block[:, column]
+        right[k + column, :] -= right[k, :]
+        _reduce_facade(x, k, left, right)
+        start += 1
+
+def exact_smith_normal_form(mat):
+    '''
+    Returns (D, (U, V)) as smith_normal_form, but never wrong from int64 
+    overflow: with Python ints (dtype object) if the Hadamard bound on 
+    |det(mat)| does not fit in int64, else in int64, checked by 
+    U * D * V = mat with Python ints and redone with them if it fails.
+    '''
+    work = np.array(mat, dtype=object)
+    if np.asarray(mat).dtype != object and _hadamard_bits(work) < 62:
+        d, (u, v) = smith_normal_form(np.asmatrix(np.asarray(mat)))
+        product = np.asarray(u).astype(object).dot(
+            np.asarray(d).astype(object)).dot(np.asarray(v).astype(object))
+        if (product == work).all():
+            return d, (u, v)
+        if verbose:
+            print 'int64 Smith normal form overflowed, using Python ints'
+    return smith_normal_form(np.asmatrix(work))
+
+def _hadamard_bits(work):
+    '''Returns an upper bound (int) on the number of bits of |det(work)| 
+    from the Hadamard bound prod_i |row_i|, for the square object array 
+    'work'; 0 if a row is zero.'''
+    norms = [sum(n * n for n in row) for row in work.tolist()]
+    if 0 in norms:
+        return 0
+    return int(sum(math.log(n, 2) / 2 for n in norms)) + 1
+
+def invariant_factors(mat):
+    '''
+    Returns the invariant factors of the nonsingular square integer matrix
+    mat as a list, the diagonal of smith_normal_form(mat)[0], without U 
+    and V. Fast for large matrices when only the structure of the module
+    ZZ^n / mat ZZ^n is needed.
+    
+    The module has order R = |det(mat)|, so R ZZ^n is in mat ZZ^n and the
+    entries can be kept modulo R (Hafner-McCurley). Block by block, 
+    unimodular row and column operations (_clear_first_column) leave the
+    first row and column zero except for the pivot a, which splits off
+    ZZ/gcd(a, R); the rest has order R / gcd(a, R), so R shrinks. The 
+    cyclic factors are then rearranged to divide each other.
+    '''
+    modulus = abs(determinant(mat))
+    work = np.array(mat, dtype=object)
+    size = work.shape[0]
+    if modulus == 0:
+        raise ValueError('Singular matrix, use smith_normal_form.')
+    # products of two entries fit in int64 below 2^31
+    work = (work % modulus).astype(np.int64 if modulus < 2**31 else object)
+    cyclic = []
+    for k in xrange(size):
+        if modulus == 1:
+            break
+        block = work[k:, k:]
+        block %= modulus
+        while True:
+            _clear_first_column(block, modulus)
+            _clear_first_column(block.T, modulus) # the first row
+            if not np.any(block[1:, 0]):
+                break
+        factor = gcd(int(block[0, 0]), modulus, False)
+        cyclic.append(factor)
+        modulus //= factor
+    # ZZ/a x ZZ/b ~ ZZ/gcd(a, b) x ZZ/lcm(a, b)
+    cyclic = [n for n in cyclic if n != 1]
+    for i in xrange(len(cyclic)):
+        for j in xrange(i + 1, len(cyclic)):
+            common = gcd(cyclic[i], cyclic[j], False)
+            cyclic[i], cyclic[j] = common, cyclic[i] // common * cyclic[j]
+    return [1 for i in xrange(size - len(cyclic))] + cyclic
+
+def _clear_first_column(block, modulus):
+    '''Makes block[1:, 0] zero by unimodular row operations modulo 
+    'modulus', in place: combines row 0 with each row whose first entry the
+    pivot does not divide (so the pivot becomes their gcd), then subtracts
+    multiples of row 0 from all the rows at once.'''
+    pivot = block[0, 0]
+    column = block[1:, 0]
+    if pivot:
+        rows = np.flatnonzero(column % pivot) + 1
+    else:
+        rows = np.flatnonzero(column) + 1
+    for i in rows:
+        a, b = int(block[0, 0]), int(block[i, 0])
+        common, (u, v) = gcd(a, b)
+        first, other = block[0].copy(), block[i].copy()
+        block[0] = (u * first + v * other) % modulus
+        block[i] = (a // common * other - b // common * first) % modulus
+    pivot = block[0, 0]
+    if pivot:
+        # only the rows with a nonzero quotient change; sparse forms have few
+        rows = np.flatnonzero(block[1:, 0]) + 1
+        columns = np.flatnonzero(block[0])
+        quotients = block[rows, 0] // pivot
+        block[np.ix_(rows, columns)] = (block[np.ix_(rows, columns)] - 
+            np.outer(quotients, block[0, columns])) % modulus
+
+def determinant(mat):
+    '''
+    Returns the determinant (int) of the square integer matrix mat.
+    
+    Gaussian elimination modulo primes p < 2^31 in int64, combined by the
+    Chinese remainder theorem until the product of the primes is more than
+    twice the Hadamard bound prod_i |row_i|. A SparseForm with a forest of
+    entries off the diagonal is not densified (SparseForm.determinant).
+    '''
+    if isinstance(mat, SparseForm):
+        return mat.determinant()
+    work = np.array(mat, dtype=object)
+    size = work.shape[0]
+    if size == 0:
+        return 1
+    bits = _hadamard_bits(work)
+    if bits == 0: # a zero row
+        return 0
+    bits += 1
+    residue, product = 0, 1
+    for p in _primes():
+        if product.bit_length() > bits:
+            break
+        det = _determinant_mod(work, p)
+        # residue + product * t = det (mod p)
+        t = (det - residue) * pow(product % p, p - 2, p) % p
+        residue += product * t
+        product *= p
+    return residue - product if residue > product // 2 else residue
+
+def _determinant_mod(mat, p):
+    '''Returns det(mat) modulo the prime p < 2^31 (int).'''
+    work = np.array(mat % p, dtype=np.int64)
+    size = work.shape[0]
+    det = 1
+    for k in xrange(size):
+        rows = np.flatnonzero(work[k:, k])
+        if not len(rows):
+            return 0
+        if rows[0]:
+            i = k + rows[0]
+            work[[k, i]] = work[[i, k]]
+            det = -det
+        pivot = int(work[k, k])
+        det = det * pivot % p
+        factors = work[k + 1:, k] * pow(pivot, p - 2, p) % p
+        work[k + 1:, k:] = (work[k + 1:, k:] - 
+                            np.outer(factors, work[k, k:]) % p) % p
+    return det % p
+
+_PRIMES = [] # primes below 2^31, from the largest down, found as needed
+
+def _primes():
+    '''Generates the primes below 2^31, from the largest down.'''
+    for p in _PRIMES:
+        yield p
+    candidate = _PRIMES[-1] - 2 if _PRIMES else 2**31 - 1
+    while True:
+        if all(candidate % d for d in xrange(3, int(math.sqrt(candidate)) + 1,
+                                             2)):
+            _PRIMES.append(candidate)
+            yield candidate
+        candidate -= 2
+
 def all_zero_facade(mat):
     return np.all(mat[0,1:] == 0) and np.all(mat[1:, 0] == 0)
 
@@ -144,43 +408,39 @@ def col_row_norm(mat, i, j):
 def best_pivot_whole(mat, debug=False):
     '''Chooses the pivot in the matrix with least col_row_norm, and of those 
     chooses the one of least value.'''
-    if debug:
-        norm = lambda i, j : mat[i, j]
-    else:
-        norm = functools.partial(col_row_norm, mat)
     if np.all(mat == 0):
         return (0, 0)
-    min_found = None
-    mins = []
-    mat_nonzero = nonzero_filter(mat)
-    for p, val in np.ndenumerate(mat):
-        mins, min_found = could_be_min(norm, mins, min_found, p, val)
-    return select_smallest_index(mins)
+    return select_pivot(mat, np.nonzero(np.asarray(mat)), debug)
 
 def best_pivot_facade(mat, debug=False):
-    if debug:
-        norm = lambda i, j : mat[i, j]
-    else:
-        norm = functools.partial(col_row_norm, mat)
+    '''Chooses the pivot in the facade (first row and column, except 
+    mat[0, 0]) as best_pivot_whole, the first row before the column.'''
     if all_zero_facade(mat):
         return (0, 0)
-    row = mat[0, 1:]
-    row_iter = np.ndenumerate(row)
-    col = mat[1:, 0]
-    col_iter = np.ndenumerate(col)
-    mins = []
-    min_found = None
-    for p, val in row_iter:
-        if val == 0:
-            continue
-        ind = 0, p[1] + 1
-        mins, min_found = could_be_min(norm, mins, min_found, ind, val)
-    for p, val in col_iter:
-        if val == 0:
-            continue
-        ind = p[0] + 1, 0
-        mins, min_found = could_be_min(norm, mins, min_found, ind, val)
-    return select_smallest_index(mins)
+    arr = np.asarray(mat)
+    cols = np.nonzero(arr[0, 1:])[0] + 1
+    rows = np.nonzero(arr[1:, 0])[0] + 1
+    candidates = (np.concatenate((np.zeros(len(cols), dtype=int), rows)),
+                  np.concatenate((cols, np.zeros(len(rows), dtype=int))))
+    return select_pivot(mat, candidates, debug)
+
+def select_pivot(mat, candidates, debug=False):
+    '''Returns the (i, j) of the candidates (index arrays (rows, columns)
+    of nonzero entries) with least col_row_norm, of those the one of least
+    magnitude, and of those the first. Same as could_be_min over the 
+    candidates in order then select_smallest_index, but with the norms of
+    all the rows and columns from one pass over mat.
+    debug - use the value mat[i, j] as the norm instead'''
+    arr = np.asarray(mat)
+    rows, cols = candidates
+    if debug:
+        norms = arr[rows, cols]
+    else:
+        squares = arr * arr
+        norms = squares.sum(axis=1)[rows] * squares.sum(axis=0)[cols]
+    least = np.flatnonzero(norms == norms.min())
+    k = least[np.argmin(np.absolute(arr[rows[least], cols[least]]))]
+    return int(rows[k]), int(cols[k])
 
 def could_be_min(norm, mins, min_found, p, val):
     '''Compares norm(p) with the previously found minimum. Adds to 
@@ -0,0 +1,153 @@
+# FILE: sparse_form.py
+
+'''
+Sparse symmetric integer matrices, for the quadratic forms of plumbing graphs
+(seifert.s_quad_form, weighted_graph.g_quad, plumbing.Plumbing.quad with
+sparse=True).
+
+A form is stored as its diagonal (the weights) and one entry for each pair of
+rows with a nonzero entry off the diagonal (the edges), so a tree of n
+vertices takes O(n) memory. Anything that needs the matrix itself (NDQF,
+smith.smith_normal_form, numpy) densifies it through numpy.asarray. When the
+entries off the diagonal form a forest, negative definiteness and the
+determinant come from eliminating leaves instead, in O(n).
+'''
+
+import numpy
+from fractions import Fraction
+from numpy import linalg as LA
+
+class SparseForm(object):
+    '''
+    A symmetric integer matrix with diagonal 'diagonal' (list of ints) and
+    entries[(row, column)] = value (int, nonzero) for row < column.
+    '''
+    def __init__(self, diagonal, entries=()):
+        '''
+        diagonal - the diagonal entries
+        entries - (row, column, value) triples off the diagonal; value is
+                  added at (row, column) and (column, row)
+        '''
+        self.diagonal = [int(n) for n in diagonal]
+        self.entries = {}
+        for row, column, value in entries:
+            if row == column:
+                raise ValueError('Entry (%i, %i) is on the diagonal'
+                                 % (row, column))
+            key = (min(row, column), max(row, column))
+            self.entries[key] = self.entries.get(key, 0) + int(value)
+        for key in [key for key, value in self.entries.iteritems()
+                    if value == 0]:
+            del self.entries[key]
+
+    @classmethod
+    def from_dense(cls, mat):
+        '''Returns the SparseForm of the symmetric square matrix 'mat'.'''
+        mat = numpy.asarray(mat)
+        if mat.shape[0] != mat.shape[1] or not (mat == mat.T).all():
+            raise ValueError('not a symmetric matrix')
+        rows, columns = numpy.nonzero(numpy.triu(mat, 1))
+        return cls(numpy.diagonal(mat).tolist(),
+                   [(row, column, mat[row, column]) for row, column in
+                    zip(rows.tolist(), columns.tolist())])
+
+    def __len__(self):
+        return len(self.diagonal)
+
+    @property
+    def shape(self):
+        return (len(self), len(self))
+
+    def dense(self):
+        '''Returns the matrix as a numpy array (int).'''
+        mat = numpy.diag(numpy.array(self.diagonal, dtype=int))
+        for (row, column), value in self.entries.iteritems():
+            mat[row, column] = mat[column, row] = value
+        return mat
+
+    def __array__(self, dtype=None):
+        if dtype is None:
+            return self.dense()
+        return self.dense().astype(dtype)
+
+    def __eq__(self, other):
+        return isinstance(other, SparseForm) and \
+               self.diagonal == other.diagonal and self.entries == other.entries
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'SparseForm(%r, %r)' % (self.diagonal,
+            sorted((row, column, value) for (row, column), value in
+                   self.entries.iteritems()))
+
+    def neighbours(self):
+        '''Returns the list of the other rows with an entry, for each row.'''
+        neighbours = [[] for n in self.diagonal]
+        for row, column in self.entries:
+            neighbours[row].append(column)
+            neighbours[column].append(row)
+        return [sorted(others) for others in neighbours]
+
+    def pivots(self):
+        '''
+        Returns the pivots (list of Fractions) of Gaussian elimination on the
+        rows in order from the leaves of the forest of the entries off the
+        diagonal, or None if they do not form a forest or a pivot is zero
+        (this order cannot go on without pivoting).
+
+        Eliminating a leaf only changes the diagonal entry of its parent,
+        d(parent) -= entry^2 / d(leaf), so there is no fill-in. The matrix is
+        negative definite iff every pivot is negative, and the determinant is
+        their product.
+        '''
+        neighbours = self.neighbours()
+        parents = [None] * len(self)
+        order = [] # breadth first from a root of each tree
+        for root in xrange(len(self)):
+            if parents[root] is not None:
+                continue
+            parents[root] = -1
+            position = len(order)
+            order.append(root)
+            while position < len(order):
+                node = order[position]
+                position += 1
+                for other in neighbours[node]:
+                    if other == parents[node]:
+                        continue
+                    if parents[other] is not None: # a cycle
+                        return None
+                    parents[other] = node
+                    order.append(other)
+        pivots = [Fraction(n) for n in self.diagonal]
+        for node in reversed(order): # leaves first
+            if pivots[node] == 0:
+                return None
+            parent = parents[node]
+            if parent >= 0:
+                value = self.entries[min(node, parent), max(node, parent)]
+                pivots[parent] -= Fraction(value * value) / pivots[node]
+        return [pivots[n] for n in reversed(order)]
+
+    def is_negative_definite(self):
+        '''
+        Return True if the matrix is negative definite, False otherwise, from
+        the pivots if there are any (see pivots), else from the eigenvalues.
+        '''
+        pivots = self.pivots()
+        if pivots is None:
+            return bool((LA.eigvalsh(self.dense()) < 0).all())
+        return all(pivot < 0 for pivot in pivots)
+
+    def determinant(self):
+        '''
+        Returns the determinant (int), from the pivots if there are any (see 
+        pivots), else from smith.determinant.
+        '''
+        pivots = self.pivots()
+        if pivots is None:
+            from smith import determinant
+            return determinant(self.dense())
+        return int(reduce(lambda x, y: x * y, pivots, Fraction(1)))
@@ -0,0 +1,213 @@
+# FILE: term_cache.py
+
+'''
+Persistent on-disk cache of correction terms.
+
+Entries are keyed by the quadratic form up to simultaneous permutation of its
+rows and columns (canonical_key), so the same form loaded from a different
+Knotilus archive, Plink file or Seifert data is only computed once. Each entry
+is stored in a SQLite file and holds the structure of H_1(Y), one
+representative characteristic vector per class with the maximum |alpha|^2 of
+that class, and the pretty-printed correction terms. The least recently used
+entries are removed once the entries take up more than max_size bytes.
+
+The cache is off unless the environment variable HFHOM_CACHE is set, to the
+path of the cache file or to 'on' for DEFAULT_PATH.
+
+Invalidation: an entry depends only on the form, so it never goes stale as
+inputs change. What can go stale is the cache itself, if the way correction
+terms or keys are computed changes; CACHE_VERSION is part of every key, so
+bumping it makes old entries unreachable (they are evicted as they age), and
+deleting the file or calling CorrTermCache.clear() empties it at once. The
+key is not fully canonical (see canonical_order), so one form may be stored
+under several keys, which costs a miss and some space but never a wrong
+answer: a hit is only used if the stored representatives map back to one
+class each of the form asked for.
+'''
+
+import hashlib, json, os, sqlite3, time
+import numpy as np
+from fractions import Fraction
+from ndqf import lrange
+
+DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.hfhom',
+                            'corrterms.sqlite')
+MAX_SIZE = 2**26 # bytes of stored entries before evicting (64 MB)
+CACHE_VERSION = 1 # bump when stored entries are no longer valid
+
+def refine(neighbors, labels):
+    '''
+    Returns the labels (ints) of the vertices after color refinement:
+    vertices keep the same label only while they have the same label and
+    the same multiset of (edge weight, neighbor label).
+
+    neighbors - list of [(weight, j), ...] for each vertex
+    labels - list of sortable initial labels
+    '''
+    num_labels = len(set(labels))
+    while True:
+        signatures = [(labels[i],
+                       tuple(sorted((w, labels[j]) for w, j in neighbors[i])))
+                      for i in xrange(len(labels))]
+        ranks = dict((sig, rank) for rank, sig in
+                     enumerate(sorted(set(signatures))))
+        labels = [ranks[sig] for sig in signatures]
+        if len(ranks) == num_labels:
+            return labels
+        num_labels = len(ranks)
+
+def canonical_order(mat):
+    '''
+    Returns an ordering of the vertices (rows) of the symmetric integer
+    matrix 'mat', depending only on mat up to simultaneous permutation of
+    rows and columns.
+
+    Vertices are colored by diagonal entry and refined by their neighbors
+    (off-diagonal entries). Ties left over are broken by singling out the
+    first vertex of the smallest tied color and refining again; this is
+    canonical when the tied vertices are related by a symmetry of the form
+    (e.g. equal branches of a star), otherwise equal forms may get different
+    keys, which only costs a cache miss.
+    '''
+    rows = np.asarray(mat).tolist()
+    size = len(rows)
+    neighbors = [[(rows[i][j], j) for j in xrange(size) \
+                  if j != i and rows[i][j]] for i in xrange(size)]
+    labels = refine(neighbors, [rows[i][i] for i in xrange(size)])
+    while len(set(labels)) < size:
+        tied = min(label for label in labels if labels.count(label) > 1)
+        first = labels.index(tied)
+        labels = refine(neighbors, [(label, i != first) \
+                                    for i, label in enumerate(labels)])
+    return sorted(xrange(size), key=lambda i: labels[i])
+
+def canonical_key(mat):
+    '''
+    Returns (key, order): the hex digest identifying 'mat' up to
+    simultaneous permutation, and the ordering from canonical_order.
+    The key is computed from CACHE_VERSION and mat[order][:, order].
+    '''
+    order = canonical_order(mat)
+    permuted = np.asarray(mat)[np.ix_(order, order)]
+    text = '%i:' % CACHE_VERSION + \
+           ';'.join(','.join(str(int(n)) for n in row) \
+                    for row in permuted.tolist())
+    return hashlib.sha1(text).hexdigest(), order
+
+class CorrTermCache(object):
+    '''Correction terms of quadratic forms (NDQF objects), stored in a
+    SQLite file.'''
+
+    def __init__(self, path=DEFAULT_PATH, max_size=MAX_SIZE):
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.path = path
+        self.max_size = max_size
+        # batch workers share the file; wait for each other's writes
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS terms ('
+                                'key TEXT PRIMARY KEY, entry TEXT, '
+                                'size INTEGER, used REAL)')
+        self.connection.commit()
+
+    def get(self, form):
+        '''
+        Returns the correction terms (list of Fractions) of the NDQF 'form',
+        in the order of its classes (lrange(form.group.structure)),
+        or None if they are not in the cache.
+        '''
+        key, order = canonical_key(form.mat)
+        row = self.connection.execute('SELECT entry FROM terms WHERE key = ?',
+                                      (key,)).fetchone()
+        if row is None:
+            return None
+        self.connection.execute('UPDATE terms SET used = ? WHERE key = ?',
+                                (time.time(), key))
+        self.connection.commit()
+        entry = json.loads(row[0])
+        if entry['structure'] != form.group.structure:
+            return None
+        # stored representatives are in canonical order; find their classes
+        maxes = [None for i in xrange(form.num_classes)]
+        for rep, magnitude in zip(entry['reps'], entry['maxes']):
+            alpha = np.zeros(form.b, dtype=np.int64)
+            alpha[order] = rep
+            maxes[form.class_index(alpha)] = magnitude
+        if None in maxes:
+            return None
+        return [Fraction(Fraction(alpha, entry['denom']) + form.b, 4) \
+                for alpha in maxes]
+
+    def put(self, form, corrterms):
+        '''
+        Stores the correction terms 'corrterms' (list of Fractions, in the
+        order of lrange(form.group.structure)) of the NDQF 'form', then
+        evicts the least recently used entries if over max_size.
+        '''
+        key, order = canonical_key(form.mat)
+        denom = form.int_inverse[1]
+        reps = []
+        for coef_list in lrange(form.group.structure):
+            rep = np.asarray(form.find_rep(coef_list)).ravel()[order]
+            reps.append([int(n) for n in rep])
+        # corrterm = (|alpha|^2 + b)/4, |alpha|^2 = numerator / denom
+        maxes = [(4 * term - form.b) * denom for term in corrterms]
+        assert all(magnitude.denominator == 1 for magnitude in maxes)
+        entry = json.dumps({'structure': [int(n) for n in
+                                          form.group.structure],
+                            'denom': int(denom),
+                            'reps': reps,
+                            'maxes': [int(magnitude) for magnitude in maxes],
+                            'terms': form.pretty_print(corrterms)})
+        self.connection.execute('INSERT OR REPLACE INTO terms '
+                                'VALUES (?, ?, ?, ?)',
+                                (key, entry, len(entry), time.time()))
+        self.connection.commit()
+        self.evict()
+
+    def evict(self):
+        '''Removes the least recently used entries until the entries take up
+        at most max_size bytes.'''
+        total = self.size()
+        while total > self.max_size:
+            key, size = self.connection.execute(
+                'SELECT key, size FROM terms ORDER BY used LIMIT 1').fetchone()
+            self.connection.execute('DELETE FROM terms WHERE key = ?', (key,))
+            total -= size
+        self.connection.commit()
+
+    def size(self):
+        '''Returns the number of bytes taken up by the entries.'''
+        total = self.connection.execute('SELECT SUM(size) FROM terms')
+        return total.fetchone()[0] or 0
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM terms').fetchone()[0]
+
+    def clear(self):
+        '''Removes all entries.'''
+        self.connection.execute('DELETE FROM terms')
+        self.connection.commit()
+
+_default_cache = None
+
+def default_cache():
+    '''
+    Returns the CorrTermCache at HFHOM_CACHE (DEFAULT_PATH if it is 'on'),
+    shared by all callers, or None if HFHOM_CACHE is unset, empty or 'off',
+    or the file cannot be used.
+    '''
+    global _default_cache
+    path = os.environ.get('HFHOM_CACHE', '')
+    if path in ('', 'off'):
+        return None
+    if path == 'on':
+        path = DEFAULT_PATH
+    if _default_cache is None or _default_cache.path != path:
+        try:
+            _default_cache = CorrTermCache(path)
+        except (OSError, sqlite3.Error) as e:
+            print 'Not using correction term cache: %s' % e
+            return None
+    return _default_cache
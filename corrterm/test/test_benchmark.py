@@ -0,0 +1,36 @@
+'''
+tests for benchmark.py
+'''
+
+import nose
+import numpy as np
+from benchmark import *
+from graph_quad import is_negative_definite
+
+def test_corpus():
+    names = corpus()
+    assert 'knotilus:10x-2-1' in names
+    assert 'plink:t4_p_normal' in names
+    assert 'forest:%i' % FORESTS[-1] in names
+    assert len(names) == len(set(names))
+
+def test_random_forest():
+    for size in range(1, 12):
+        quad = random_forest(size, seed=size)
+        assert np.array_equal(quad, quad.T)
+        assert is_negative_definite(quad)
+        assert np.array_equal(quad, random_forest(size, seed=size))
+
+def test_regressions():
+    baseline = {'a': {'times': {'NDQF': 1.0, 'pruned': 0.01}, 'rss': 100,
+                      'corrterms': '0'}}
+    same = {'a': {'times': {'NDQF': 1.2, 'pruned': 0.04}, 'rss': 120,
+                  'corrterms': '0'}}
+    assert regressions(same, baseline) == []
+    slower = {'a': {'times': {'NDQF': 2.0, 'pruned': 0.01}, 'rss': 100,
+                    'corrterms': '1/2'},
+              'b': {'failed': 'IndexError'}}
+    assert len(regressions(slower, baseline)) == 3
+
+if __name__ == '__main__':
+    nose.runmodule()
@@ -0,0 +1,94 @@
+'''
+tests for corrterms.py
+'''
+
+import json, os, shutil, subprocess, sys, tempfile
+import nose
+from nose.tools import assert_raises
+from StringIO import StringIO
+from corrterms import *
+
+GUI_MODULES = ['Tkinter', 'tkFileDialog', 'tkMessageBox', 'matplotlib', 
+               'networkx', 'plink']
+
+# run in a new interpreter, so that modules imported by other tests don't count
+STARTUP_SCRIPT = '''
+import json, sys
+import corrterms
+print json.dumps(sorted(set(name.split('.')[0] for name in sys.modules 
+                            if sys.modules[name])))
+'''
+
+# saved by weighted_graph.py: a -3 vertex with three -3 leaves
+GRAPH = '''N0 N1 N2 N3
+N1
+N2
+N3
+
+DATA
+[('N0', {'weight': -3, 'parent': -1}), ('N1', {'weight': -3, 'parent': 0}), \
+('N2', {'weight': -3, 'parent': 0}), ('N3', {'weight': -3, 'parent': 0})]
+'''
+
+def test_parse_manifest_line():
+    assert parse_manifest_line('\n') is None
+    assert parse_manifest_line('# comment') is None
+    assert parse_manifest_line('[-1, (2, 1), (3, 1)]\n') == \
+           ('s', '[-1, (2, 1), (3, 1)]')
+    assert parse_manifest_line('-kf testing/10x-2-1.txt') == \
+           ('kf', 'testing/10x-2-1.txt')
+    assert parse_manifest_line('-s  [2,(3,1)] ') == ('s', '[2,(3,1)]')
+    assert_raises(ValueError, parse_manifest_line, 'testing/10x-2-1.txt')
+
+def test_homology_only():
+    assert homology_only('s', '[-1, (2, 1), (3, 1), (5, 1)]') == '1'
+    assert homology_only('s', '[0,(3,-1),(3,2),(2,-1)]') == 'Z/3Z'
+    assert homology_only('s', '[-4]') == 'Z/4Z'
+
+def test_startup():
+    # the computational core must not need a display stack; the time of the
+    # import is measured by benchmark.py (workload startup:corrterms)
+    directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.check_output([sys.executable, '-c', STARTUP_SCRIPT], 
+                                     cwd=directory)
+    modules = set(json.loads(output.splitlines()[-1]))
+    assert 'corrterms' in modules
+    assert not modules & set(GUI_MODULES), modules & set(GUI_MODULES)
+
+def test_batch():
+    directory = tempfile.mkdtemp()
+    saved = os.environ.get('HFHOM_CACHE')
+    os.environ['HFHOM_CACHE'] = 'off'
+    try:
+        graph = os.path.join(directory, 'graph.txt')
+        with open(graph, 'w') as graph_file:
+            graph_file.write(GRAPH)
+        manifest = os.path.join(directory, 'manifest.txt')
+        with open(manifest, 'w') as manifest_file:
+            manifest_file.write('# Poincare sphere\n'
+                                '[-1, (2, 1), (3, 1), (5, 1)]\n'
+                                '-s [0,(3,-1),(3,2),(2,-1)]\n'
+                                '-q nonsense\n'
+                                '-g %s\n' % graph)
+        out = StringIO()
+        batch(manifest, out, processes=2)
+        results = [json.loads(line) for line in out.getvalue().splitlines()]
+        results = dict((result['line'], result) for result in results)
+        assert sorted(results.keys()) == [2, 3, 4, 5]
+        assert results[2]['homology'] == '1'
+        assert results[2]['corrterms'] == '2'
+        assert results[3]['homology'] == 'Z/3Z'
+        assert results[3]['corrterms'] == '-3/2, -1/6, -1/6'
+        assert results[3]['self_conjugate'] == [0]
+        assert 'error' in results[4]
+        assert results[5]['homology'] == homology_only('g', graph)
+        assert results[5]['corrterms'] == graph_corr(graph)
+    finally:
+        if saved is None:
+            os.environ.pop('HFHOM_CACHE', None)
+        else:
+            os.environ['HFHOM_CACHE'] = saved
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    nose.runmodule()
@@ -7,6 +7,8 @@ Tests for graph_quad.py
 '''
 
 from graph_quad import *
+from plink_load import load_plink, make_objects
+from knotilus_load import load
 import nose, os
 from nose.tools import assert_raises
 
@@ -20,18 +22,13 @@ internet = True # Set this to False if you do not have Internet connection.
 def test_last_ancestor():
     num_nodes = 12
     gNodes = [NodeClass(i) for i in range(num_nodes)]
-    gNodes[0].path = [0]
-    gNodes[1].path = [0, 1]
-    gNodes[2].path = [0, 1, 2]
-    gNodes[3].path = [0, 3]
-    gNodes[4].path = [0, 4]
-    gNodes[5].path = [0, 3, 5]
-    gNodes[6].path = [0, 3, 5, 6]
-    gNodes[7].path = [0, 3, 5, 6, 7]
-    gNodes[8].path = [0, 1, 8]
-    gNodes[9].path = [0, 3, 5, 9]
-    gNodes[10].path = [0, 3, 5, 6, 7, 10]
-    gNodes[11].path = [0, 3, 5, 9, 11]    
+    paths = [[0], [0, 1], [0, 1, 2], [0, 3], [0, 4], [0, 3, 5], [0, 3, 5, 6],
+             [0, 3, 5, 6, 7], [0, 1, 8], [0, 3, 5, 9], [0, 3, 5, 6, 7, 10],
+             [0, 3, 5, 9, 11]]
+    for node, path in zip(gNodes, paths): # parent pointers of the tree
+        node.depth = len(path) - 1
+        if len(path) > 1:
+            node.parent = gNodes[path[-2]]
     
     for i in range(num_nodes):
         assert gNodes[0].last_ancestor(gNodes[i]) == 0
@@ -124,6 +121,43 @@ def test_edges_regions():
     assert edge_list_tuples.count((1, 2)) == 1
 
 
+def test_region_adjacency():
+    from plink_classes import RegionClass
+    a, b, c, d = [IntersectionClass(None, None, (i, 0)) for i in range(4)]
+    # c is visited twice by region 1 (self-loop)
+    regions = [RegionClass([a, b, d], 0), RegionClass([c, b, c, a], 0),
+               RegionClass([d], 0)]
+    assert region_adjacency(regions).tolist() == [[0, 1], [0, 1], [0, 2], 
+                                                  [1, 1]]
+    nodes = [NodeClass(i) for i in range(3)]
+    edges = edges_regions(nodes, regions)
+    assert [y.edge for y in edges] == [(0, 1), (0, 1), (0, 2), (1, 1)]
+    assert [len(node.edges) for node in nodes] == [3, 3, 1]
+    assert region_adjacency([]).shape == (0, 2)
+
+def test_goeritz_form():
+    from plink_classes import RegionClass
+    from ndqf import NDQF
+    from smith import invariant_factors
+    for archive in ['10x-2-1', '7x-1-2']:
+        if internet:
+            regions = load(archive)[3]
+        else:
+            regions = load('%s/testing/%s.txt' % (path, archive), 
+                           filename=True)[3]
+        nodes = [NodeClass(i) for i in range(len(regions))]
+        edge_list = edges_regions(nodes, regions)
+        tree = maximal_subtree(edge_list, nodes)
+        quad = quad_form(tree, minus_maximal_subtree(edge_list, tree), nodes)
+        goeritz = goeritz_form(regions)
+        assert goeritz.shape == quad.shape
+        assert invariant_factors(goeritz) == invariant_factors(quad)
+        assert sorted(NDQF(goeritz).correction_term_list()) == \
+               sorted(NDQF(quad).correction_term_list())
+    # kink: the one shaded region visits the intersection twice
+    a = IntersectionClass(None, None, (0, 0))
+    assert numpy.array_equal(goeritz_form([RegionClass([a, a], 0)]), [[-1]])
+
 def test_maximal_subtree():
     assert maximal_subtree([DirEdgeClass((0,0))], [NodeClass(0)]) == []
     # Test P1
@@ -157,6 +191,22 @@ def test_maximal_subtree():
     tree_k2 = maximal_subtree(edge_list_k2, nodes_k2)
     assert len(tree_k2) == 3
     assert [tree_k2[i].edge for i in range(3)] == [(0,1), (0,3), (1,2)]
+    
+    # long cycle: paths to the root are walked, not stored on each node
+    size = 5000
+    nodes = [NodeClass(i) for i in range(size)]
+    edges = [DirEdgeClass((i, (i + 1) % size)) for i in range(size)]
+    for edge in edges:
+        for index in edge.edge:
+            nodes[index].edges.append(edge)
+    tree = maximal_subtree(edges, nodes)
+    assert len(tree) == size - 1
+    assert minus_maximal_subtree(edges, tree) == [edges[size / 2]]
+    assert [node.depth for node in nodes[:3]] == [0, 1, 2]
+    assert nodes[size - 1].parent is nodes[0]
+    assert nodes[size / 2].last_ancestor(nodes[size / 2 + 1]) == 0
+    cycle = circuit(tree, edges[size / 2], nodes)
+    assert len(cycle[0]) + len(cycle[1]) == size
 
 #
 # Quadratic Form tests
@@ -316,5 +366,21 @@ def test_quad_form():
             edge_list_k3, maximal_subtree(edge_list_k3, nodes_k3)), nodes_k3),\
             k3_array)
     
+def test_quad_form_engines():
+    for edge_list, nodes in [(edge_list_p1, nodes_p1), (edge_list_p2, nodes_p2),
+                             (edge_list_p3, nodes_p3), (edge_list_p4, nodes_p4),
+                             (edge_list_k1, nodes_k1), (edge_list_k2, nodes_k2)]:
+        tree = maximal_subtree(edge_list, nodes)
+        minus = minus_maximal_subtree(edge_list, tree)
+        circuits = circuit_matrix(tree, minus, nodes)
+        assert circuits.shape[0] == len(minus)
+        for i, edge1 in enumerate(minus): # -C C^T entries are shared_edges
+            for j, edge2 in enumerate(minus):
+                assert -circuits[i].dot(circuits[j]) == shared_edges(\
+                    circuit(tree, edge1, nodes), circuit(tree, edge2, nodes))
+        assert numpy.array_equal(quad_form(tree, minus, nodes),
+                                 quad_form(tree, minus, nodes, engine='pairs'))
+    assert_raises(ValueError, quad_form, tree, minus, nodes, engine='other')
+    
 if __name__ == '__main__':
     nose.runmodule()
\ No newline at end of file
@@ -1,4 +1,5 @@
 import nose
+import nose.tools
 from ndqf import *
 
 def test_lrange():
@@ -51,5 +52,265 @@ def test_hom_group():
     one = np.matrix([[1, 0], [0, 1]])
     g_one = Hom_Group(one, one)
 
+def test_class_index():
+    forms = [[[-5, 2], [2, -4]],
+             [[-2, -1, -1], [-1, -2, -1], [-1, -1, -2]],
+             [[-3, -1, -1, 0], [-1, -4, -2, 0], [-1, -2, -4, 1], [0, 0, 1, -3]],
+             [[-3, -2, -1, -1], [-2, -5, -2, -3], [-1, -2, -4, -3],
+              [-1, -3, -3, -5]]]
+    for form in forms:
+        q = NDQF(form)
+        reps = map(q.find_rep, lrange(q.group.structure))
+        assert q.num_classes == len(reps)
+        for index, rep in enumerate(reps):
+            assert q.class_index(rep) == index
+        characteristic = [list(alpha) for alpha in q.get_alpha() 
+                          if map(mod2, q.diagonal, alpha) == [0] * q.b]
+        assert [list(alpha) for alpha in q.get_alpha(characteristic=True)] \
+               == characteristic
+        assert len(characteristic) == \
+               reduce(lambda x, y: x*y, q.max_bounds(True)[1])
+        for alpha in q.get_alpha():
+            if map(mod2, q.diagonal, alpha) == [0] * q.b:
+                assert q.class_index(alpha) == q.equiv_class(alpha, reps)
+
+def test_correction_terms_pruned():
+    forms = [[[-5, 2], [2, -4]],
+             [[-7]],
+             [[-2, 0], [0, -2]],
+             [[-3, -1, -1, 0], [-1, -4, -2, 0], [-1, -2, -4, 1], [0, 0, 1, -3]],
+             [[-2, 1, 0, 0, 0], [1, -3, 1, 1, 0], [0, 1, -2, 0, 0],
+              [0, 1, 0, -2, 1], [0, 0, 0, 1, -2]],
+             [[-3, -2, -1, -1], [-2, -5, -2, -3], [-1, -2, -4, -3],
+              [-1, -3, -3, -5]]]
+    for form in forms:
+        q = NDQF(form)
+        assert q.correction_terms_pruned() == q.correction_terms_ugly()
+        assert sorted(q.search_order()) == range(q.b)
+        for alpha in q.get_alpha():
+            if map(mod2, q.diagonal, alpha) == [0] * q.b:
+                reduced = q.descend(alpha)
+                assert q.class_index(reduced) == q.class_index(alpha)
+                assert q.find_abs(reduced) >= q.find_abs(alpha)
+        assert 0 < q.prune_slack() < 1e-12
+
+def test_auto_engine():
+    q = NDQF([[-3, -1, -1, 0], [-1, -4, -2, 0], [-1, -2, -4, 1], [0, 0, 1, -3]])
+    assert q.auto_engine() == 'box' # small box
+    assert q.correction_term_list() == q.correction_terms_ugly()
+    # a 12 x 12 diagonal form has 5^12 / 2 alphas in half its box
+    q = NDQF(np.diag([-4] * 12))
+    assert q.auto_engine() == 'pruned'
+    assert NDQF([[-1]]).auto_engine() == 'box'
+
+def test_correction_terms_batch():
+    forms = [[[-5, 2], [2, -4]],
+             [[-7]],
+             [[-3, -1, -1, 0], [-1, -4, -2, 0], [-1, -2, -4, 1], [0, 0, 1, -3]],
+             [[-3, -2, -1, -1], [-2, -5, -2, -3], [-1, -2, -4, -3],
+              [-1, -3, -3, -5]]]
+    for form in forms:
+        q = NDQF(form)
+        blocks = list(q.get_alpha_blocks(block_size=7))
+        assert np.concatenate(blocks).tolist() == \
+               [list(alpha) for alpha in q.get_alpha()]
+        assert all(len(block) <= 7 for block in blocks)
+        assert q.correction_terms_batch(block_size=7) == \
+               q.correction_terms_ugly()
+
+def test_box_maxes_int64():
+    assert NDQF([[-5, 2], [2, -4]]).fits_int64()
+    # unimodular with Fibonacci entries: |alpha|^2 can pass 2^62 in the box
+    fib = [0, 1]
+    while len(fib) < 34:
+        fib.append(fib[-1] + fib[-2])
+    q = NDQF([[-fib[33], fib[32]], [fib[32], -fib[31]]])
+    assert q.int_inverse[0].dtype == np.int64 and not q.fits_int64()
+    # the walk fallback agrees with the numpy blocks
+    q = NDQF([[-3, -2, -1, -1], [-2, -5, -2, -3], [-1, -2, -4, -3],
+              [-1, -3, -3, -5]])
+    maxes = q.box_maxes(5, 40)
+    q.fits_int64 = lambda: False
+    walked = q.box_maxes(5, 40)
+    assert walked.dtype == object
+    assert [m for m in maxes.tolist() if m > np.iinfo(np.int64).min] == \
+           [m for m in walked.tolist() if m != float('-inf')]
+    assert q.correction_terms_batch() == q.correction_terms_ugly()
+
+def test_correction_terms_bounded():
+    forms = [[[-5, 2], [2, -4]],
+             [[-7]],
+             [[-2, 0], [0, -2]],
+             [[-2, 1, 0, 0, 0], [1, -3, 1, 1, 0], [0, 1, -2, 0, 0],
+              [0, 1, 0, -2, 1], [0, 0, 0, 1, -2]],
+             [[-3, -2, -1, -1], [-2, -5, -2, -3], [-1, -2, -4, -3],
+              [-1, -3, -3, -5]]]
+    for form in forms:
+        q = NDQF(form)
+        bands = [q.get_alpha_band(low, high) for low, high in 
+                 [(-1, 3), (3, 10), (10, 1000)]]
+        assert sorted(np.concatenate(bands).tolist()) == \
+               sorted(list(alpha) for alpha in q.get_alpha(characteristic=True))
+        terms = q.correction_terms_ugly()
+        assert q.correction_terms_bounded() == terms
+        for coef_list, term in zip(lrange(q.group.structure), terms):
+            magnitude = int(q.find_abs(q.find_rep(coef_list)))
+            assert (term * 4 - q.b) * q.int_inverse[1] <= \
+                   q.class_bound(magnitude)
+        assert q.class_map.dtype == np.int64
+        assert ((q.class_map >= 0) & 
+                (q.class_map < q.class_orders[:, np.newaxis])).all()
+        q.fits_int64 = lambda: False # walks the box
+        assert q.correction_terms_bounded() == terms
+    # Smith form in object dtype, trivial group
+    fib = [0, 1]
+    while len(fib) < 62:
+        fib.append(fib[-1] + fib[-2])
+    q = NDQF(np.array([[-fib[61], fib[60]], [fib[60], -fib[59]]], 
+                      dtype=object))
+    assert q.class_map.shape == (0, 2) and not q.fits_int64()
+
+def test_correction_terms_threaded():
+    q = NDQF([[-3, -2, -1, -1], [-2, -5, -2, -3], [-1, -2, -4, -3],
+              [-1, -3, -3, -5]])
+    total = len(q.get_alpha(characteristic=True))
+    halves = np.maximum(q.box_maxes(0, total // 3), q.box_maxes(total // 3))
+    assert np.all(halves == q.box_maxes())
+    assert q.correction_terms_threaded(processes=3) == q.correction_terms_ugly()
+
+def test_alpha_range():
+    alphas = AlphaRange([-1, 0, 5], [3, 1, 2])
+    assert len(alphas) == 6
+    assert [list(alpha) for alpha in alphas] == \
+           [[-1, 0, 5], [0, 0, 5], [1, 0, 5], [-1, 0, 6], [0, 0, 6], [1, 0, 6]]
+    # shards, parity steps, blocks
+    assert [list(alpha) for alpha in AlphaRange([-1, 0, 5], [3, 1, 2], 
+                                                start=2, stop=4)] == \
+           [[1, 0, 5], [-1, 0, 6]]
+    assert list(AlphaRange([1], [4], start=3, stop=2)) == []
+    alphas = AlphaRange([-3, -2], [4, 3], steps=[2, 2])
+    assert [list(alpha) for alpha in alphas] == \
+           [[a, b] for b in (-2, 0, 2) for a in (-3, -1, 1, 3)]
+    for start, stop in ((0, None), (5, 11), (7, 100)):
+        alphas = AlphaRange([-3, -2], [4, 3], steps=[2, 2], start=start,
+                            stop=stop)
+        blocks = list(alphas.blocks(block_size=4))
+        assert np.concatenate(blocks).tolist() == \
+               [list(alpha) for alpha in alphas]
+        assert [alphas.vector(number) for number in 
+                xrange(alphas.start, alphas.stop)] == \
+               [list(alpha) for alpha in alphas]
+
+def test_walk():
+    forms = [[[-5, 2], [2, -4]],
+             [[-7]],
+             [[-1]],
+             [[-2, 0], [0, -2]],
+             [[-3, -1, -1, 0], [-1, -4, -2, 0], [-1, -2, -4, 1], [0, 0, 1, -3]],
+             [[-2, 1, 0, 0, 0], [1, -3, 1, 1, 0], [0, 1, -2, 0, 0],
+              [0, 1, 0, -2, 1], [0, 0, 0, 1, -2]]]
+    for form in forms:
+        q = NDQF(form)
+        total = len(q.get_alpha(characteristic=True))
+        for start, stop in ((0, None), (total // 3, 2 * total // 3),
+                            (total - 1, None)):
+            alphas = q.get_alpha(start, stop, characteristic=True)
+            walked = [(list(alpha), index, magnitude) for alpha, index,
+                      magnitude in q.walk(alphas)]
+            assert walked == [(list(alpha), q.class_index(alpha),
+                               q.find_abs(alpha)) for alpha in alphas]
+        assert list(q.walk(q.get_alpha(3, 3, characteristic=True))) == []
+
+def test_conjugates():
+    forms = [[[-5, 2], [2, -4]],
+             [[-2, 0], [0, -2]],
+             [[-2, -1, -1], [-1, -2, -1], [-1, -1, -2]],
+             [[-3, -1, -1, 0], [-1, -4, -2, 0], [-1, -2, -4, 1], [0, 0, 1, -3]],
+             [[-2, 1, 0, 0, 0], [1, -3, 1, 1, 0], [0, 1, -2, 0, 0],
+              [0, 1, 0, -2, 1], [0, 0, 0, 1, -2]]]
+    for form in forms:
+        q = NDQF(form)
+        for alpha in q.get_alpha(characteristic=True):
+            negative = [-a for a in alpha]
+            assert q.class_index(negative) == \
+                   q.conjugate_index(q.class_index(alpha))
+        conjugates = [q.conjugate_index(c) for c in xrange(q.num_classes)]
+        assert conjugates == q.conjugate_indices().tolist()
+        assert [conjugates[c] for c in conjugates] == range(q.num_classes)
+        evens = len([n for n in q.group.structure if n % 2 == 0])
+        assert len(q.self_conjugate()) == 2**evens
+        assert q.self_conjugate() == [c for c in xrange(q.num_classes) 
+                                      if conjugates[c] == c]
+        terms = q.correction_terms_ugly()
+        assert terms == [terms[c] for c in conjugates]
+        # the negatives of the first half are the rest of the box
+        alphas = [tuple(alpha) for alpha in q.get_alpha(characteristic=True)]
+        half = [tuple(alpha) for alpha in 
+                q.get_alpha(characteristic=True, half=True)]
+        assert set(half) | set(tuple(-a for a in alpha) for alpha in half) \
+               == set(alphas)
+        assert len(half) == (len(alphas) + 1) // 2
+
+def test_large_group():
+    # |H_1| = 2^9 * 1000003: nothing per class is built up front
+    q = NDQF(np.diag([-2] * 9 + [-1000003]))
+    assert q.num_classes == 2**9 * 1000003
+    spin = q.self_conjugate()
+    assert len(spin) == 2**9
+    assert all(q.conjugate_index(index) == index for index in spin)
+    assert q.conjugate_index(1) != 1
+
+def test_reduced_form():
+    skew = np.array([[1, 2, 0], [0, 1, -1], [0, 0, 1]])
+    forms = [[[-5, 2], [2, -4]],
+             [[-7]],
+             [[-2, -1, -1], [-1, -2, -1], [-1, -1, -2]],
+             skew.T.dot([[-2, 1, 0], [1, -3, 1], [0, 1, -2]]).dot(skew),
+             [[-3, -1, -1, 0], [-1, -4, -2, 0], [-1, -2, -4, 1], [0, 0, 1, -3]],
+             [[-3, -2, -1, -1], [-2, -5, -2, -3], [-1, -2, -4, -3],
+              [-1, -3, -3, -5]]]
+    for form in forms:
+        q = NDQF(form)
+        reduced, basis = q.reduced_form()
+        assert abs(round(np.linalg.det(basis))) == 1
+        assert np.all(reduced.mat == basis.T.dot(np.asarray(q.mat)).dot(basis))
+        assert sum(reduced.diagonal) <= sum(q.diagonal)
+        terms = q.correction_term_list(engine='box', reduced=False)
+        assert q.correction_term_list(engine='box') == terms
+        for engine in ('box', 'pruned'):
+            corrterms = q.reduced_correction_terms(engine=engine)
+            assert corrterms is None or corrterms == terms
+    # the skewed form has a much larger box than its reduction
+    assert NDQF(forms[3]).reduced_correction_terms() is not None
+    # Gram matrix of the lattice spanned by (1, 0), (1, 1), with H * gram * H^T
+    # the Gram matrix of the reduced basis
+    assert lll_reduce([[1, 1], [1, 2]]) in ([[1, 0], [-1, 1]],
+                                            [[1, 0], [1, -1]])
+
+def test_exact_inverse():
+    forms = [[[-5, 2], [2, -4]],
+             [[-7]],
+             [[0, 1], [1, 0]],
+             [[-3, -1, -1, 0], [-1, -4, -2, 0], [-1, -2, -4, 1], [0, 0, 1, -3]],
+             [[-3, -2, -1, -1], [-2, -5, -2, -3], [-1, -2, -4, -3],
+              [-1, -3, -3, -5]]]
+    for form in forms:
+        m = np.matrix(form)
+        inverse, denom = NDQF.exact_inverse(m)
+        assert denom > 0
+        assert np.all(inverse * m == denom * np.eye(len(form), dtype=int))
+        d, (u, v) = smith_normal_form(m)
+        old_inverse, old_denom = NDQF.int_matrix(NDQF.rational_inverse(d, u, v),
+                                                 len(form))
+        assert denom == old_denom
+        assert np.all(inverse == old_inverse)
+    # entries too big for int64
+    big = np.matrix([[1, 1], [1, 2**70]], dtype=object)
+    inverse, denom = NDQF.exact_inverse(big)
+    assert denom == 2**70 - 1
+    assert inverse.tolist() == [[2**70, -1], [-1, 1]]
+    singular = np.matrix([[1, 2], [2, 4]])
+    nose.tools.assert_raises(ValueError, NDQF.exact_inverse, singular)
+
 if __name__=="__main__":
     result = nose.run()
@@ -0,0 +1,98 @@
+'''
+tests for plumbing.py
+'''
+
+import os, random
+import nose
+import networkx as nx
+from nose.tools import assert_raises
+from fractions import gcd
+from graph_quad import is_negative_definite
+from ndqf import NDQF
+from plumbing import *
+import seifert
+
+TESTING = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..',
+                       'testing')
+
+def node_list(graph):
+    return ['N%i' % index for index in xrange(len(graph.nodes(data=False)))]
+
+def random_star(generator):
+    '''Returns the star-shaped tree of random Seifert data, or None if its
+    form is not negative definite.'''
+    listdata = [generator.randint(-4, 4)]
+    for j in xrange(generator.randint(0, 4)):
+        p = generator.randint(2, 9)
+        q = generator.choice(range(-p, 0) + range(1, p + 1))
+        if abs(gcd(p, q)) == 1:
+            listdata.append((p, q))
+    if seifert.invariants(listdata)[1] >= 0: # else not negative definite
+        return None
+    return seifert.make_graph(listdata)
+
+def join(first, second):
+    '''Returns the disjoint union of the graphs, with an edge between their
+    first vertices, and the second graph's nodes renumbered after the first.'''
+    graph = first.copy()
+    offset = len(first.nodes(data=False))
+    for node, data in second.nodes(data=True):
+        graph.add_node('N%i' % (int(node[1:]) + offset), **data)
+    for one, other in second.edges():
+        graph.add_edge('N%i' % (int(one[1:]) + offset),
+                       'N%i' % (int(other[1:]) + offset))
+    graph.add_edge('N0', 'N%i' % offset)
+    return graph
+
+def test_outward():
+    values = outward(7 / 3.0)
+    assert [values.next() for i in xrange(5)] == [2, 3, 1, 4, 0]
+    values = outward(-2.5)
+    assert sorted(values.next() for i in xrange(4)) == [-4, -3, -2, -1]
+
+def test_p_corr_terms():
+    generator = random.Random(2)
+    graphs = []
+    while len(graphs) < 30:
+        star = random_star(generator)
+        if star is None:
+            continue
+        if generator.random() < 0.5: # up to 2 bad vertices
+            other = random_star(generator)
+            if other is None:
+                continue
+            star = join(star, other)
+        quad = Plumbing(star, node_list(star)).quad()
+        if is_negative_definite(quad) and len(quad) <= 10:
+            graphs.append(star)
+    for graph in graphs:
+        nodes = node_list(graph)
+        plumbing = Plumbing(graph, nodes)
+        assert len(plumbing.bad) <= 2
+        quadform = NDQF(plumbing.quad())
+        assert p_corr_terms(graph, nodes, quadform) == \
+               quadform.correction_term_list()
+    # the check searches the quadratic form, here with multiprocessing
+    graph = graphs[0]
+    assert p_corr_terms(graph, node_list(graph), check=True, 
+                        multiprocessing=True) == \
+           NDQF(Plumbing(graph, node_list(graph)).quad()).correction_term_list()
+    # a disagreement raises, also under python -O
+    quadform = NDQF(Plumbing(graph, node_list(graph)).quad())
+    quadform.correction_term_list = lambda *args: []
+    assert_raises(RuntimeError, p_corr_terms, graph, node_list(graph), 
+                  quadform, check=True)
+
+def test_forest_file():
+    from weighted_graph import GraphPopup, g_quad
+    popup = GraphPopup(None, gui=False)
+    popup.load(os.path.join(TESTING, 'forest_ex2.txt'))
+    plumbing = Plumbing(popup.graph, popup.nodes)
+    assert plumbing.bad == [4]
+    assert sorted(sum((vertices for vertices, branch, links in 
+                       plumbing.trees), plumbing.bad)) == range(16)
+    assert (plumbing.quad() == g_quad(popup.graph, popup.nodes, 
+                                      gui=False)).all()
+
+if __name__ == '__main__':
+    nose.runmodule()
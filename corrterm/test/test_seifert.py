@@ -71,5 +71,43 @@ def test_s_quad_form():
     assert numpy.array_equal(quad_form2[0],\
                              s_quad_form([-1,(-1,0),(2,1),(3,1),(5,1)])[0])
 
+def test_s_homology():
+    for listdata in ([-1,(2,1),(3,1),(5,1)], [0,(3,-1),(3,2),(2,-1)], [-4],
+                     [-2,(3,1),(3,1),(3,1),(3,1)], [3,(2,-1),(3,-2),(7,-6)]):
+        assert s_homology(listdata) == \
+               NDQF(s_quad_form(listdata, gui=False)[0]).group.struct()
+
+def test_s_corr_terms():
+    assert s_corr_terms([-1,(2,1),(3,1),(5,1)]) == [2]
+    assert s_corr_terms([0,(3,-1),(3,2),(2,-1)]) == \
+           [Fraction(3,2), Fraction(1,6), Fraction(1,6)]
+    assert s_corr_terms([-4]) == [Fraction(1,4), 0, Fraction(-3,4), 0]
+    # the check searches the quadratic form, here with multiprocessing
+    assert s_corr_terms([0,(3,-1),(3,2),(2,-1)], check=True,
+                        multiprocessing=True) == \
+           [Fraction(3,2), Fraction(1,6), Fraction(1,6)]
+    # a disagreement raises, also under python -O
+    quadform = NDQF(s_quad_form([-4], gui=False)[0])
+    quadform.correction_term_list = lambda *args: []
+    assert_raises(RuntimeError, s_corr_terms, [-4], quadform, check=True)
+    # agrees with the quadratic form search on random Seifert data
+    random.seed(1)
+    checked = 0
+    while checked < 40:
+        listdata = [random.randint(-5, 5)]
+        for j in range(random.randint(0, 4)):
+            p = random.randint(2, 12)
+            q = random.choice(range(-2*p, 0) + range(1, 2*p + 1))
+            if abs(gcd(p, q)) == 1:
+                listdata.append((p, q))
+        if invariants(listdata)[1] == 0:
+            continue
+        quadform = NDQF(s_quad_form(listdata, gui=False)[0])
+        if quadform.b > 12:
+            continue
+        assert s_corr_terms(listdata, quadform) == \
+               quadform.correction_term_list()
+        checked += 1
+
 if __name__ == '__main__':
     nose.runmodule()
@@ -6,7 +6,35 @@ import random
 from smith        import *
 from numpy.linalg import det
 from number_theory import divides, div_alg
-from qc           import *
+
+# random test data in the style of the qc (QuickCheck) package, which is not
+# a dependency: generators yield the boundary cases first, then random ones
+
+def integers(low=0, high=100):
+    '''Endlessly yields random integers between low and high (inclusive).'''
+    yield low
+    yield high
+    while True:
+        yield random.randint(low, high)
+
+def lists(items=integers(), size=(0, 100)):
+    '''Endlessly yields random lists of length size[0] to size[1].'''
+    yield [items.next() for _ in xrange(size[0])]
+    yield [items.next() for _ in xrange(size[1])]
+    while True:
+        yield [items.next() for _ in xrange(random.randint(*size))]
+
+def forall(tries=100, **generators):
+    '''Runs the decorated test 'tries' times, with each keyword argument
+    drawn from its generator.'''
+    def wrap(test):
+        @functools.wraps(test)
+        def wrapped():
+            for _ in xrange(tries):
+                test(**dict((name, generator.next()) for name, generator 
+                            in generators.iteritems()))
+        return wrapped
+    return wrap
 
 def matrices(items=integers(), size=(0, 30)):
     '''Generates random matrices using the qc syntax.'''
@@ -138,6 +166,20 @@ def test_best_pivot_facade(m):
         if mins:
             assert m[p] == min(mins)
 
+def test_select_pivot():
+    mat = np.matrix([[0, 2, -1, 0], [3, 0, 1, 1], [-1, 4, 0, 2], [0, 1, 1, -5]])
+    norm = functools.partial(col_row_norm, mat)
+    whole = (np.array([i for i in xrange(4) for j in xrange(4) if mat[i, j]]),
+             np.array([j for i in xrange(4) for j in xrange(4) if mat[i, j]]))
+    mins, min_found = [], None
+    for p in zip(*whole):
+        mins, min_found = could_be_min(norm, mins, min_found, p, mat[p])
+    assert select_pivot(mat, whole) == select_smallest_index(mins)
+    assert best_pivot_whole(mat) == select_smallest_index(mins)
+    assert best_pivot_whole(mat, debug=True) == (3, 3)
+    assert best_pivot_facade(mat) == (0, 2)
+    assert best_pivot_facade(mat, debug=True) == (0, 2) # row first
+
 def test_all_zero_facade():
     one = np.matrix([[1, 3], [0, 9]])
     two = np.matrix([[0, 0], [0, 17]])
@@ -220,6 +262,69 @@ def test_random_smith_normal_form(m):
             print m
         assert divides(s[i, i], s[i + 1, i + 1])
 
+@forall(tries=10, m=matrices(items=integers(-20, 20), size=(1, 12)))
+def test_smith_normal_form_engines(m):
+    '''The iterative engine makes the same operations as the recursive one,
+    and with an object array, works with integers of any size.'''
+    d, (u, v) = smith_normal_form(m, engine='recursive')
+    d2, (u2, v2) = smith_normal_form(m, engine='iterative')
+    assert np.all(d == d2) and np.all(u == u2) and np.all(v == v2)
+    d3, (u3, v3) = smith_normal_form(m.astype(object))
+    assert np.all(d3 == d)
+    assert np.all(u3 * d3 * v3 == m)
+
+def test_smith_normal_form_big():
+    m = np.matrix([[9, 4, -12, 1, 4, 9, 2, 0],
+                   [0, 0, 0, 0, 4, 0, 6, 6],
+                   [9, 9, 6, -12, -12, 4, -12, 0],
+                   [0, 0, 1, -1, 2, 4, 6, 0],
+                   [2, -3, -1, 0, -3, -1, 4, 2],
+                   [-12, -12, 0, 6, 6, 1, 0, 2],
+                   [-1, 6, -12, -1, 1, 2, 4, 6],
+                   [-3, 1, -1, 9, -3, 0, 2, 1]], dtype=object)
+    d, (u, v) = smith_normal_form(m)
+    assert np.diagonal(d).tolist() == [1, 1, 1, 1, 1, 1, 2, 57494844]
+    assert max(abs(n) for n in v.A.ravel()) > 2**63 # past int64
+    assert np.all(u * d * v == m)
+
+def test_exact_smith_normal_form():
+    # same matrix as test_smith_normal_form_big: int64 overflows in V
+    m = np.matrix([[9, 4, -12, 1, 4, 9, 2, 0],
+                   [0, 0, 0, 0, 4, 0, 6, 6],
+                   [9, 9, 6, -12, -12, 4, -12, 0],
+                   [0, 0, 1, -1, 2, 4, 6, 0],
+                   [2, -3, -1, 0, -3, -1, 4, 2],
+                   [-12, -12, 0, 6, 6, 1, 0, 2],
+                   [-1, 6, -12, -1, 1, 2, 4, 6],
+                   [-3, 1, -1, 9, -3, 0, 2, 1]])
+    d, (u, v) = exact_smith_normal_form(m)
+    assert v.dtype == object # redone with Python ints
+    assert np.diagonal(d).tolist() == [1, 1, 1, 1, 1, 1, 2, 57494844]
+    assert np.all(u * d * v == m)
+    small = np.matrix([[-2, 1], [1, -3]])
+    d, (u, v) = exact_smith_normal_form(small)
+    assert d.dtype == np.int64 # no overflow, stays int64
+    assert np.all(d == smith_normal_form(small)[0])
+
+@forall(tries=10, m=matrices(items=integers(-20, 20), size=(1, 12)))
+def test_invariant_factors(m):
+    d = smith_normal_form(m.astype(object))[0]
+    det = determinant(m)
+    assert det == reduce(lambda x, y: x * y, np.diagonal(d).tolist(), 1) * \
+                  int(round(np.sign(la.det(m))))
+    if det:
+        assert invariant_factors(m) == np.diagonal(d).tolist()
+
+def test_determinant():
+    assert determinant(np.matrix([[-5, 2], [2, -4]])) == 16
+    assert determinant(np.matrix([[0, 1], [1, 0]])) == -1
+    assert determinant(np.matrix([[1, 2], [2, 4]])) == 0
+    # past 2^63, so from several primes
+    big = np.matrix(np.diag([10**7 + 19] * 4) - 1)
+    assert determinant(big) == (10**7 + 15) * (10**7 + 19)**3
+    assert invariant_factors(big) == [1, 10**7 + 19, 10**7 + 19, 
+                                      (10**7 + 15) * (10**7 + 19)]
+
 @forall(tries=5, d=diagonals(size2=(1, 10)))
 def test_solve_diagonal(d):
     '''Result should be still diagonal and have diagonal chaining.'''
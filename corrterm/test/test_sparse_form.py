@@ -0,0 +1,71 @@
+'''
+tests for sparse_form.py
+'''
+
+import random
+import nose
+import numpy
+from nose.tools import assert_raises
+from sparse_form import *
+from graph_quad import is_negative_definite
+from ndqf import NDQF
+from smith import determinant, invariant_factors
+import seifert
+
+def random_form(generator):
+    '''Returns a random SparseForm, usually a forest, sometimes a cycle.'''
+    size = generator.randint(1, 8)
+    entries = [(i, generator.randrange(i), generator.randint(-3, 3)) for i in
+               xrange(1, size) if generator.random() < 0.8]
+    if size > 2 and generator.random() < 0.3:
+        entries.append((0, size - 1, generator.randint(-2, 2)))
+    return SparseForm([generator.randint(-6, 0) for i in xrange(size)],
+                      entries)
+
+def test_dense():
+    form = SparseForm([-2, -3, -1], [(0, 1, 1), (2, 1, 1), (1, 2, 1),
+                                     (0, 2, 1), (0, 2, -1)])
+    assert form.entries == {(0, 1): 1, (1, 2): 2}
+    assert len(form) == 3 and form.shape == (3, 3)
+    dense = numpy.array([[-2, 1, 0], [1, -3, 2], [0, 2, -1]])
+    assert numpy.array_equal(form.dense(), dense)
+    assert numpy.array_equal(numpy.asarray(form), dense)
+    assert SparseForm.from_dense(dense) == form
+    assert form.neighbours() == [[1], [0, 2], [1]]
+    assert_raises(ValueError, SparseForm, [0, 0], [(1, 1, 1)])
+    assert_raises(ValueError, SparseForm.from_dense, [[0, 1], [0, 0]])
+
+def test_pivots():
+    assert SparseForm([-2, -2], [(0, 1, 1)]).pivots() == [-2, Fraction(-3, 2)]
+    assert SparseForm([-2] * 3, [(0, 1, 1), (1, 2, 1), (0, 2, 1)]).pivots() \
+           is None # cycle
+    generator = random.Random(1)
+    for i in xrange(300):
+        form = random_form(generator)
+        dense = form.dense()
+        assert form.is_negative_definite() == \
+               bool((numpy.linalg.eigvalsh(dense) < 0).all())
+        assert is_negative_definite(form) == form.is_negative_definite()
+        assert form.determinant() == determinant(form) == determinant(dense)
+
+def test_consumers():
+    for listdata in [[-2, (2, 1), (3, 1), (5, 1)], [0, (3, -1), (2, -1),
+                                                   (2, -1)], [-4]]:
+        form, minus = seifert.s_quad_form(listdata, gui=False, sparse=True)
+        dense = seifert.s_quad_form(listdata, gui=False)[0]
+        assert isinstance(form, SparseForm)
+        assert numpy.array_equal(form.dense(), dense)
+        assert invariant_factors(form) == invariant_factors(dense)
+        assert NDQF(form).correction_term_list() == \
+               NDQF(dense).correction_term_list()
+
+def test_big_tree():
+    # 2002 vertices: the determinant is found without densifying
+    form = seifert.s_quad_form([2, (1000, 1), (1001, 1), (3, 1)], gui=False,
+                               sparse=True)[0]
+    assert len(form) == 2002
+    assert is_negative_definite(form)
+    assert determinant(form) == 7013003 # even size
+
+if __name__ == '__main__':
+    nose.runmodule()
@@ -0,0 +1,74 @@
+'''
+tests for term_cache.py
+'''
+
+import os, shutil, tempfile
+import nose
+import numpy as np
+from ndqf import NDQF
+from term_cache import *
+
+FORMS = [[[-5, 2], [2, -4]],
+         [[-2, 1, 0, 0, 0], [1, -3, 1, 1, 0], [0, 1, -2, 0, 0],
+          [0, 1, 0, -2, 1], [0, 0, 0, 1, -2]],
+         [[-3, -2, -1, -1], [-2, -5, -2, -3], [-1, -2, -4, -3],
+          [-1, -3, -3, -5]]]
+
+def permute(form, perm):
+    return np.asarray(form)[np.ix_(perm, perm)]
+
+def test_canonical_key():
+    for form in FORMS:
+        key = canonical_key(form)[0]
+        size = len(form)
+        for perm in (range(size)[::-1], range(1, size) + [0]):
+            assert canonical_key(permute(form, perm))[0] == key
+    # star with equal branches: ties broken by symmetry
+    star = [[-3, 1, 1, 1], [1, -2, 0, 0], [0, 0, -2, 0], [0, 0, 0, -2]]
+    star = np.triu(star) + np.triu(star, 1).T
+    assert canonical_key(star)[0] == canonical_key(permute(star, [2, 0, 3, 1]))[0]
+    assert canonical_key(FORMS[0])[0] != canonical_key(FORMS[1])[0]
+
+def test_cache():
+    directory = tempfile.mkdtemp()
+    try:
+        cache = CorrTermCache(os.path.join(directory, 'terms.sqlite'))
+        for form in FORMS:
+            size = len(form)
+            first = NDQF(form)
+            assert cache.get(first) is None
+            cache.put(first, first.correction_terms_ugly())
+            # a permuted form has its classes in a different order
+            second = NDQF(permute(form, range(size)[::-1]))
+            assert cache.get(second) == second.correction_terms_ugly()
+            assert cache.get(first) == first.correction_terms_ugly()
+        assert len(cache) == len(FORMS)
+        # evicts least recently used
+        cache.max_size = cache.size() - 1
+        cache.get(NDQF(FORMS[0]))
+        cache.evict()
+        assert len(cache) == len(FORMS) - 1
+        assert cache.get(NDQF(FORMS[1])) is None
+        assert cache.get(NDQF(FORMS[0])) is not None
+    finally:
+        shutil.rmtree(directory)
+
+def test_default_cache():
+    saved = os.environ.pop('HFHOM_CACHE', None)
+    directory = tempfile.mkdtemp()
+    try:
+        assert default_cache() is None # opt-in
+        os.environ['HFHOM_CACHE'] = 'off'
+        assert default_cache() is None
+        path = os.path.join(directory, 'terms.sqlite')
+        os.environ['HFHOM_CACHE'] = path
+        assert default_cache().path == path
+    finally:
+        if saved is None:
+            os.environ.pop('HFHOM_CACHE', None)
+        else:
+            os.environ['HFHOM_CACHE'] = saved
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    nose.runmodule()
@@ -25,8 +25,14 @@ import traceback
 from gui_output import OutputWindow
 
 import numpy
-from graph_quad import symmetric, is_negative_definite
+from graph_quad import is_negative_definite
+from sparse_form import SparseForm
 from ndqf import NDQF
+from plumbing import p_corr_terms
+from term_cache import default_cache
+
+# what 'Done/compute' computes the correction terms from
+ENGINES = ['plumbing graph', 'quadratic form']
 
 class GraphPopup(Frame):
     '''
@@ -42,7 +48,7 @@ class GraphPopup(Frame):
         self.show_hom = show_hom # variable
         self.show_quad = show_quad # variable
         self.show_weighted = show_weighted # variable
-        self.use_multi = use_multi
+        self.use_multi = use_multi # for the quadratic form search
         self.info = 'unknown' # inputinfo for the output window
         self.nodes = []
         if graph:
@@ -117,6 +123,16 @@ class GraphPopup(Frame):
         separator = Frame(self.frame, height=2, bd=1, relief=SUNKEN)
         separator.grid(row=7, sticky='we', padx=5, pady=5, columnspan=5)
         
+        # How to compute the correction terms
+        Label(self.frame, text='Compute from').grid(row=8, column=0)
+        self.engine = StringVar()
+        self.engine.set(ENGINES[0])
+        OptionMenu(self.frame, self.engine, *ENGINES).grid(row=8, column=1,
+                                                           columnspan=2)
+        self.check = IntVar() # check the plumbing graph against the form
+        Checkbutton(self.frame, text='Check', variable=self.check).grid(row=8,
+                                                                    column=3)
+        
         # File buttons
         Button(self.frame, text='Draw graph', command=self.update_graph).grid(\
             row=9, column=0)
@@ -432,7 +448,20 @@ class GraphPopup(Frame):
         self.save()        
         quad = g_quad(self.graph, self.nodes)
         quadform = NDQF(quad)
-        corr = quadform.correction_terms(self.use_multi.get())
+        if self.engine.get() == 'quadratic form': # search of the form
+            corr = quadform.correction_terms(self.use_multi.get(), 
+                                             cache=default_cache())
+        else: # computed from the trees of the graph (plumbing.py)
+            try:
+                corr = p_corr_terms(self.graph, self.nodes, quadform, 
+                                    cache=default_cache(), 
+                                    check=self.check.get(),
+                                    multiprocessing=self.use_multi.get())
+            except RuntimeError as error: # the check failed
+                tkMessageBox.showwarning('Check failed', str(error))
+                print traceback.print_exc()
+                return
+            corr = quadform.pretty_print(corr)
         struct = quadform.group.struct()
         
         self.top.destroy()
@@ -482,10 +511,11 @@ def num_bad_vertices(graph, node_list):
             num += 1
     return num
     
-def g_quad(graph, node_list, gui=True):
+def g_quad(graph, node_list, gui=True, sparse=False):
     '''
     Return quadratic form (numpy array) of networkx graph 'graph', ordered
-    according to the node names in 'node_list'.
+    according to the node names in 'node_list'. With sparse=True, return it
+    as a SparseForm (sparse_form.py) instead, which is never densified here.
     
     Q(v,v) = weight(v)
     Q(v,w) = 1 if v, w are connected by an edge; 0 otherwise
@@ -500,17 +530,21 @@ def g_quad(graph, node_list, gui=True):
             tkMessageBox.showwarning('Bad vertices', 
                           'More than two bad vertices. (There are %i.)'%num_bad)
         raise ValueError('More than two bad vertices. (There are %i.)'%num_bad)
-    # create adjacency matrix, ordered according to node_list
-    adj = nx.to_numpy_matrix(graph, nodelist=node_list, dtype=numpy.int)
-    for index, node in enumerate(node_list): # change diagonal
-        adj[index, index] = graph.node[node]['weight']
+    # weights down the diagonal and an entry for each edge, ordered 
+    # according to node_list
+    index = dict((node, k) for k, node in enumerate(node_list))
+    adj = SparseForm([graph.node[node]['weight'] for node in node_list],
+                     [(index[one], index[other], 1) for one, other in 
+                      graph.edges()])
     if not is_negative_definite(adj):
         if gui:
             tkMessageBox.showwarning('Quadratic form', 
                                      'Quadratic form is not negative definite')
-        print adj
+        print adj.dense()
         raise ValueError('quadratric form is not negative definite')        
-    return adj
+    if sparse:
+        return adj
+    return adj.dense()
 
 
 if __name__ == '__main__':